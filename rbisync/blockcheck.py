@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2015-2016 Alexey Naumov <rocketbuzzz@gmail.com>
+#
+# This file is part of rbisync.
+#
+# rbisync is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import binascii
+from abc import abstractmethod
+
+CRC16_POLYNOMIAL = 0xA001  # x^16 + x^15 + x^2 + 1, bit reversed
+LRC_CHUNK = 1 << 16  # (bytes) folded at once by LRC
+
+
+class AbstractBlockCheck(object):
+    '''
+    Block check character(s) sent after ETX.
+    The data may be a str, a bytearray or a memoryview.
+    '''
+
+    size = 1  # number of check characters on the line
+    initial = 0
+
+    @abstractmethod
+    def update(self, value, data):
+        '''
+        Returns the check value continued over data.
+        '''
+        pass
+
+    @abstractmethod
+    def encode(self, value):
+        pass
+
+    @abstractmethod
+    def decode(self, data):
+        pass
+
+    def compute(self, data):
+        return self.update(self.initial, data)
+
+
+class LRC(AbstractBlockCheck):
+    '''
+    Longitudinal redundancy check: XOR of all the bytes.
+    The bytes are folded as one big integer, so there is no Python level loop over the data.
+    Long data is folded LRC_CHUNK bytes at a time: the integer and its hex string take several times the size
+    of what is folded.
+    '''
+
+    def update(self, value, data):
+        length = len(data)
+        if length <= LRC_CHUNK:
+            return value ^ self.__fold(data, length)
+
+        data = memoryview(data)
+        for start in xrange(0, length, LRC_CHUNK):
+            chunk = data[start:start + LRC_CHUNK]
+            value ^= self.__fold(chunk, len(chunk))
+
+        return value
+
+    def __fold(self, data, length):
+        if not length:
+            return 0
+
+        folded = int(binascii.hexlify(data), 16)
+        while length > 1:
+            half = (length + 1) // 2
+            bits = half * 8
+            folded = (folded >> bits) ^ (folded & ((1 << bits) - 1))
+            length = half
+
+        return folded
+
+    def encode(self, value):
+        return chr(value)
+
+    def decode(self, data):
+        return ord(data[0])
+
+
+def crc16Table(polynomial):
+    table = []
+    for byte in xrange(256):
+        crc = byte
+        for _ in xrange(8):
+            crc = (crc >> 1) ^ polynomial if crc & 1 else crc >> 1
+        table.append(crc)
+
+    return table
+
+
+class CRC16(AbstractBlockCheck):
+    '''
+    CRC-16 of BSC: polynomial 0x8005, reflected, initial value 0, sent low byte first.
+    '''
+
+    size = 2
+
+    TABLE = crc16Table(CRC16_POLYNOMIAL)
+
+    def update(self, value, data):
+        table = CRC16.TABLE
+        for byte in bytearray(data):
+            value = (value >> 8) ^ table[(value ^ byte) & 0xFF]
+
+        return value
+
+    def encode(self, value):
+        return chr(value & 0xFF) + chr(value >> 8)
+
+    def decode(self, data):
+        return ord(data[0]) | (ord(data[1]) << 8)
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2015-2016 Alexey Naumov <rocketbuzzz@gmail.com>
+#
+# This file is part of rbisync.
+#
+# rbisync is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+import mmap
+import time
+import struct
+
+CAPTURE_MAGIC = "RBSYNCAP"
+CAPTURE_VERSION = 1
+CAPTURE_SIZE = 1 << 20  # (bytes) of the ring file, the oldest records are overwritten once it is full
+
+# file header: magic, version, capacity of the ring, offset of the next record, offset of the oldest record,
+# bytes taken by the records
+HEADER = struct.Struct("<8sIIIII")
+# record: timestamp (ms of the port's clock), kind, length of the data that follows
+RECORD = struct.Struct("<dBH")
+
+RECORD_PAD = 0  # the rest of the ring up to its end is unused, the next record is at the start
+RECORD_TX = 1
+RECORD_RX = 2
+RECORD_STATE = 3  # data is the new state, one byte
+
+RECORD_KIND = {RECORD_TX: "TX", RECORD_RX: "RX", RECORD_STATE: "STATE"}
+
+MAX_CHUNK = 0xFFFF  # longer chunks are recorded in several records
+
+
+class Capture(object):
+    '''
+    Always-on traffic recorder: every chunk transmitted or received and every state change go as a record
+    to a fixed size memory mapped ring file. Writing a record is a couple of slice assignments into the mapping,
+    the kernel writes the pages out. Once the ring is full the oldest records are overwritten.
+    A file left by an earlier capture of the same size is continued.
+    '''
+
+    def __init__(self, path, size=CAPTURE_SIZE, clock=None):
+        self.__clock = clock if clock is not None else (lambda: time.time() * 1000)
+        self.__capacity = size - HEADER.size
+
+        self.__file = open(path, "r+b" if os.path.exists(path) else "w+b")
+        self.__file.truncate(size)
+        self.__map = mmap.mmap(self.__file.fileno(), size)
+
+        magic, version, capacity, head, tail, used = HEADER.unpack_from(self.__map, 0)
+        if magic == CAPTURE_MAGIC and version == CAPTURE_VERSION and capacity == self.__capacity:
+            self.__head, self.__tail, self.__used = head, tail, used
+        else:
+            self.__head, self.__tail, self.__used = 0, 0, 0
+            self.__writeHeader()
+
+    def close(self):
+        if self.__map is not None:
+            self.__writeHeader()
+            self.__map.close()
+            self.__file.close()
+            self.__map = None
+
+    def transmitted(self, data):
+        self.__record(RECORD_TX, data)
+
+    def received(self, data):
+        self.__record(RECORD_RX, data)
+
+    def stateChanged(self, state):
+        self.__record(RECORD_STATE, chr(state))
+
+    def __record(self, kind, data):
+        if not isinstance(data, str):
+            data = memoryview(data).tobytes()  # mmap takes str only
+
+        timestamp = self.__clock()
+        chunk = min(MAX_CHUNK, self.__capacity - RECORD.size)
+        for start in xrange(0, len(data), chunk):
+            self.__append(timestamp, kind, data[start:start + chunk])
+
+    def __append(self, timestamp, kind, data):
+        size = RECORD.size + len(data)
+        if self.__head + size > self.__capacity:
+            self.__reserve(self.__capacity - self.__head)
+            if self.__head:  # the ring did not run empty on the way, wrap around
+                if self.__capacity - self.__head >= RECORD.size:
+                    RECORD.pack_into(self.__map, HEADER.size + self.__head, 0, RECORD_PAD, 0)
+                self.__used += self.__capacity - self.__head
+                self.__head = 0
+
+        self.__reserve(size)
+
+        offset = HEADER.size + self.__head
+        RECORD.pack_into(self.__map, offset, timestamp, kind, len(data))
+        self.__map[offset + RECORD.size:offset + size] = data
+        self.__head += size
+        self.__used += size
+        self.__writeHeader()
+
+    def __reserve(self, size):
+        # drops the oldest records until size bytes after the head are free
+        while self.__used and self.__free() < size:
+            self.__dropOldest()
+
+    def __free(self):
+        if self.__head >= self.__tail and self.__used < self.__capacity:
+            return self.__capacity - self.__head  # up to the end of the ring, the start is not used by the caller
+
+        return self.__tail - self.__head
+
+    def __dropOldest(self):
+        if self.__capacity - self.__tail < RECORD.size:
+            kind, length = RECORD_PAD, 0
+        else:
+            _, kind, length = RECORD.unpack_from(self.__map, HEADER.size + self.__tail)
+
+        if kind == RECORD_PAD:
+            self.__used -= self.__capacity - self.__tail
+            self.__tail = 0
+        else:
+            self.__used -= RECORD.size + length
+            self.__tail += RECORD.size + length
+            if self.__used and self.__capacity - self.__tail < RECORD.size:
+                # the end of the ring is too short for a record, the writer went on at the start: so does the tail,
+                # or a wrapping head would pass it
+                self.__used -= self.__capacity - self.__tail
+                self.__tail = 0
+
+        if not self.__used:
+            self.__head = self.__tail = 0
+
+    def __writeHeader(self):
+        HEADER.pack_into(self.__map, 0, CAPTURE_MAGIC, CAPTURE_VERSION, self.__capacity, self.__head, self.__tail, self.__used)
+
+
+class Replayer(object):
+    '''
+    Reads a capture file back, oldest record first.
+    '''
+
+    def __init__(self, path):
+        with open(path, "rb") as captureFile:
+            self.__data = captureFile.read()
+
+        magic, version, self.__capacity, self.__head, self.__tail, self.__used = HEADER.unpack_from(self.__data, 0)
+        if magic != CAPTURE_MAGIC or version != CAPTURE_VERSION:
+            raise ValueError("%s is not a capture file." % path)
+
+    def records(self):
+        '''
+        Yields (timestamp, kind, data) of every record.
+        '''
+        offset = self.__tail
+        remaining = self.__used
+        while remaining > 0:
+            if self.__capacity - offset < RECORD.size:
+                kind = RECORD_PAD
+            else:
+                timestamp, kind, length = RECORD.unpack_from(self.__data, HEADER.size + offset)
+
+            if kind == RECORD_PAD:
+                remaining -= self.__capacity - offset
+                offset = 0
+                continue
+
+            start = HEADER.size + offset + RECORD.size
+            yield timestamp, kind, self.__data[start:start + length]
+
+            offset += RECORD.size + length
+            remaining -= RECORD.size + length
+
+    def replay(self, port, speed=None, onDone=None):
+        '''
+        Feeds the received chunks to port._receive(). With speed (1.0 is the recorded speed) the chunks are fed
+        by the port's scheduler as far apart as they were received, otherwise they are fed right away, as fast as
+        the port takes them. What the port transmits in return goes wherever its _transmit() sends it.
+        '''
+        chunks = [(timestamp, data) for timestamp, kind, data in self.records() if kind == RECORD_RX]
+        if not speed:
+            for _, data in chunks:
+                port._receive(data)
+            if onDone is not None:
+                onDone()
+            return
+
+        if not chunks:
+            if onDone is not None:
+                onDone()
+            return
+
+        started = chunks[0][0]
+        position = [0]
+
+        def feed():
+            while position[0] < len(chunks):
+                timestamp, data = chunks[position[0]]
+                delay = (timestamp - started) / speed - (port.scheduler.now() - replayStarted)
+                if delay > 0:
+                    port.scheduler.callLater(delay, feed)
+                    return
+
+                position[0] += 1
+                port._receive(data)
+
+            if onDone is not None:
+                onDone()
+
+        replayStarted = port.scheduler.now()
+        feed()
+
+
+def main():
+    if len(sys.argv) != 2:
+        print "Usage: %s CAPTURE_FILE" % os.path.basename(sys.argv[0])
+        sys.exit(1)
+
+    for timestamp, kind, data in Replayer(sys.argv[1]).records():
+        if kind == RECORD_STATE:
+            data = ord(data)
+        print "%.3f %-5s %r" % (timestamp, RECORD_KIND.get(kind, kind), data)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2015-2016 Alexey Naumov <rocketbuzzz@gmail.com>
+#
+# This file is part of rbisync.
+#
+# rbisync is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import re
+from blockcheck import LRC
+
+STX = chr(02)
+ETX = chr(03)
+ETB = chr(027)
+DLE = chr(020)
+
+TERMINATOR_PATTERN = re.compile("[%s]" % re.escape(ETX + ETB))
+
+DECODER_WAIT_FOR_STX = 0
+DECODER_WAIT_FOR_ETX = 1
+DECODER_WAIT_FOR_CHECKSUM = 2
+DECODER_WAIT_FOR_ESCAPED = 3  # transparent text, the character after DLE
+
+FRAME_CAPACITY = 256  # initial size of the receive buffer, grows on demand
+
+
+class FrameDecoder(object):
+    '''
+    Incremental STX...ETX+BCC (or STX...ETB+BCC, a block of a multi-block transmission) decoder.
+    Every received byte is looked at exactly once, the payload is collected in a preallocated buffer.
+    The blocks of a multi-block transmission are collected one after another in the same buffer, so the
+    message is never joined. onFrame gets memoryview slices of the buffer, they are only valid during the call.
+    Transparent text (DLE STX...DLE ETX, DLE doubled in between) is recognised by the DLE before STX and
+    de-stuffed on the way in: the runs between DLEs are copied as a whole.
+    '''
+
+    def __init__(self, blockCheck=None, capacity=FRAME_CAPACITY):
+        self.__blockCheck = blockCheck if blockCheck is not None else LRC()
+        self.__buffer = bytearray(capacity)
+        self.__length = 0
+        self.__blockStart = 0  # where the block being received starts in the buffer
+        self.__checksum = ""
+        self.__terminator = ETX
+        self.__state = DECODER_WAIT_FOR_STX
+        self.__transparent = False  # the block being received is transparent text
+        self.__dle = False  # the last data fed ended with DLE, the STX that follows starts transparent text
+        self.__on_frame = None
+
+    def reset(self):
+        '''
+        Drops the frame being received along with the blocks received before it.
+        '''
+        self.__blockStart = 0
+        self.__rewind()
+
+    def __rewind(self):
+        self.__length = self.__blockStart
+        self.__checksum = ""
+        self.__state = DECODER_WAIT_FOR_STX
+        self.__transparent = False
+        self.__dle = False
+
+    def feed(self, data):
+        '''
+        Decodes the data (a str, a bytearray or a memoryview), returns the number of bytes consumed.
+        Decoding stops right after a complete frame, the rest of the data is left to the caller.
+        '''
+        if isinstance(data, memoryview):
+            data = data.tobytes()  # find() and the patterns take a str or a bytearray, not a memoryview
+
+        position = 0
+        length = len(data)
+        while position < length:
+            if self.__state == DECODER_WAIT_FOR_ETX and self.__transparent:
+                index = data.find(DLE, position)
+                end = index if index >= 0 else length
+                self.__append(data, position, end)
+                position = end
+
+                if index >= 0:
+                    position += 1
+                    self.__state = DECODER_WAIT_FOR_ESCAPED
+
+                continue
+
+            if self.__state == DECODER_WAIT_FOR_ESCAPED:
+                character = data[position:position + 1]
+                position += 1
+                self.__state = DECODER_WAIT_FOR_ETX
+
+                if character == DLE:
+                    self.__append(DLE, 0, 1)
+                elif character == ETX or character == ETB:
+                    self.__terminator = str(character)
+                    self.__state = DECODER_WAIT_FOR_CHECKSUM
+                elif character == STX:
+                    self.__rewind()  # DLE STX again, the block is started over
+                    self.__transparent = True
+                    self.__state = DECODER_WAIT_FOR_ETX
+
+                continue  # anything else after DLE (DLE SYN) is idle fill
+
+            if self.__state == DECODER_WAIT_FOR_ETX:
+                match = TERMINATOR_PATTERN.search(data, position)
+                end = match.start() if match else length
+                self.__append(data, position, end)
+                position = end
+
+                if match:
+                    position += 1
+                    self.__terminator = match.group()
+                    self.__state = DECODER_WAIT_FOR_CHECKSUM
+
+                continue
+
+            if self.__state == DECODER_WAIT_FOR_STX:
+                index = data.find(STX, position)  # anything before STX is line noise
+                if index < 0:
+                    self.__dle = data[length - 1:length] == DLE
+                    return length
+
+                self.__transparent = data[index - 1:index] == DLE if index > position else self.__dle
+                self.__dle = False
+                position = index + 1
+                self.__state = DECODER_WAIT_FOR_ETX
+                continue
+
+            if self.__state == DECODER_WAIT_FOR_CHECKSUM:
+                missing = self.__blockCheck.size - len(self.__checksum)
+                self.__checksum += str(data[position:position + missing])
+                position += missing
+                if len(self.__checksum) < self.__blockCheck.size:
+                    return length
+
+                self.__complete()
+                return position
+
+        return length
+
+    def __append(self, data, start, end):
+        size = end - start
+        if not size:
+            return
+
+        required = self.__length + size
+        if required > len(self.__buffer):
+            # a new buffer rather than extend(): a bytearray can not be resized while memoryviews of it exist
+            capacity = len(self.__buffer) or 1
+            while capacity < required:
+                capacity *= 2  # the capacity stays a power of two times the initial one, a message of such a size fits
+            buffer = bytearray(capacity)
+            memoryview(buffer)[:self.__length] = memoryview(self.__buffer)[:self.__length]
+            self.__buffer = buffer
+
+        # through a memoryview: a slice of a bytearray assigned anything but a bytearray copies it first
+        memoryview(self.__buffer)[self.__length:required] = memoryview(data)[start:end]
+        self.__length = required
+
+    def __complete(self):
+        view = memoryview(self.__buffer)
+        block = view[self.__blockStart:self.__length]
+        checksumRemote = self.__blockCheck.decode(self.__checksum)
+        checksumLocal = self.__blockCheck.update(self.__blockCheck.update(self.__blockCheck.initial, block), self.__terminator)
+        final = self.__terminator == ETX
+
+        if not len(block):  # STX ETX with no message in between is not a frame
+            self.__rewind()
+            return
+
+        if final:
+            message = view[:self.__length]  # all the blocks
+            self.reset()
+        else:
+            message = block
+            self.__blockStart = self.__length
+            self.__rewind()
+
+        self.__onFrame(message, checksumLocal, checksumRemote, final)
+
+    def __onFrame(self, message, checksumLocal, checksumRemote, final):
+        if self.__on_frame:
+            self.__on_frame(message, checksumLocal, checksumRemote, final)
+
+    @property
+    def onFrame(self):
+        return self.__on_frame
+
+    @onFrame.setter
+    def onFrame(self, callback):
+        self.__on_frame = callback
+
+    @property
+    def pending(self):
+        return self.__state != DECODER_WAIT_FOR_STX
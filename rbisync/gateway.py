@@ -0,0 +1,726 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2015-2016 Alexey Naumov <rocketbuzzz@gmail.com>
+#
+# This file is part of rbisync.
+#
+# rbisync is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Headless gateway: serves many serial lines to local clients.
+
+The lines are read from an ini file, one section per line besides [gateway]:
+
+    [gateway]
+    workers = 4                     ; processes, the lines are spread over them (default: one per CPU)
+    socketDir = /var/run/rbisync    ; where the line sockets go unless a line says otherwise
+
+    [meter1]
+    port = /dev/ttyS0
+    baudRate = 9600
+    parity = even                   ; none, even, odd, mark, space
+    byteSize = 7
+    stopBits = 1                    ; 1, 1.5, 2
+    blockCheck = crc16              ; lrc, crc16
+    blockSize = 256
+    transparent = no
+    role = primary                  ; none, primary, secondary
+    highWaterMark = 1000
+    scheduling = strict             ; strict, weighted: how the priorities of FRAME_WRITE_PRIORITY share the line
+    listen = tcp:127.0.0.1:7001     ; or unix:/path, default unix:<socketDir>/<section>.sock
+
+Every worker process runs one event loop with LoopBisync ports. Each line listens on its own socket in its
+worker, so the clients talk to the process owning the port and nothing is relayed through the parent.
+On the socket both ways go frames of HEADER (kind, payload length) and the payload:
+
+    FRAME_WRITE      client -> gateway  the message to send
+    FRAME_WRITE_PRIORITY client -> gateway  PRIORITY (0 urgent, 1 normal, 2 bulk) + the message to send
+    FRAME_READ       gateway -> client  a message received, to every client of the line
+    FRAME_ERROR      gateway -> client  ERROR code + description, to every client of the line
+    FRAME_DELIVERED  gateway -> client  SEQUENCE of the FRAME_WRITE acknowledged by the peer
+    FRAME_FAILED     gateway -> client  SEQUENCE + ERROR code + description of the FRAME_WRITE not delivered
+
+The n-th FRAME_WRITE or FRAME_WRITE_PRIORITY of a connection has the sequence number n, counted from 1 on both ends.
+'''
+
+import os
+import sys
+import errno
+import time
+import signal
+import socket
+import struct
+import logging
+import argparse
+import multiprocessing
+from collections import deque
+from ConfigParser import SafeConfigParser, Error as ConfigError
+from headless import LoopBisync, newLoop
+from blockcheck import LRC, CRC16
+from outbound import QueueOverflowError, PRIORITY_NORMAL, PRIORITY_LEVELS, SCHEDULING_STRICT, SCHEDULING_WEIGHTED
+from protocol import ROLE_NONE, ROLE_PRIMARY, ROLE_SECONDARY
+
+HEADER = struct.Struct("!BI")  # kind, payload length
+SEQUENCE = struct.Struct("!I")
+PRIORITY = struct.Struct("!B")
+ERROR = struct.Struct("!i")
+
+FRAME_WRITE = 1
+FRAME_READ = 2
+FRAME_ERROR = 3
+FRAME_DELIVERED = 4
+FRAME_FAILED = 5
+FRAME_WRITE_PRIORITY = 6
+
+MAX_PAYLOAD = 1 << 20  # a longer frame is a protocol error, the connection is closed
+MAX_BACKLOG = 1 << 22  # bytes a client may leave unread before it is disconnected
+RECEIVE_SIZE = 65536
+LISTEN_BACKLOG = 16
+REOPEN_INTERVAL = 5000  # (ms) a port that can not be opened is tried again after that long
+RESPAWN_INTERVAL = 1.0  # (s) how often the gateway looks for dead workers
+
+SOCKET_DIR = "/var/run/rbisync"
+
+PARITIES = {"none": LoopBisync.PARITY_NONE,
+            "even": LoopBisync.PARITY_EVEN,
+            "odd": LoopBisync.PARITY_ODD,
+            "mark": LoopBisync.PARITY_MARK,
+            "space": LoopBisync.PARITY_SPACE}
+
+STOPBITS = {"1": LoopBisync.STOPBITS_ONE,
+            "1.5": LoopBisync.STOPBITS_ONE_POINT_FIVE,
+            "2": LoopBisync.STOPBITS_TWO}
+
+BLOCK_CHECKS = {"lrc": LRC,
+                "crc16": CRC16}
+
+BOOLEANS = {"yes": True, "no": False, "true": True, "false": False, "on": True, "off": False, "1": True, "0": False}
+
+ROLES = {"none": ROLE_NONE,
+         "primary": ROLE_PRIMARY,
+         "secondary": ROLE_SECONDARY}
+
+SCHEDULINGS = {"strict": SCHEDULING_STRICT,
+               "weighted": SCHEDULING_WEIGHTED}
+
+logger = logging.getLogger(__name__)
+
+
+def encodeFrame(kind, payload=""):
+    return HEADER.pack(kind, len(payload)) + payload
+
+
+def encodeError(error):
+    code, description = error
+    return ERROR.pack(code) + str(description)
+
+
+def decodeError(payload):
+    return ERROR.unpack_from(payload)[0], payload[ERROR.size:]
+
+
+def parseAddress(address):
+    '''
+    "unix:/path" (or just "/path") -> (AF_UNIX, "/path"), "tcp:host:port" -> (AF_INET, (host, port)).
+    '''
+    if address.startswith("tcp:"):
+        host, _, port = address[4:].rpartition(":")
+        if not host or not port.isdigit():
+            raise ValueError("Invalid TCP address %s, expected tcp:host:port." % address)
+
+        return socket.AF_INET, (host, int(port))
+
+    if address.startswith("unix:"):
+        address = address[5:]
+
+    if not address:
+        raise ValueError("Empty socket path.")
+
+    return socket.AF_UNIX, address
+
+
+class FrameReader(object):
+    '''
+    Splits a byte stream into (kind, payload) frames, a frame may come in any number of pieces.
+    '''
+
+    def __init__(self, maxPayload=MAX_PAYLOAD):
+        self.__buffer = bytearray()
+        self.__maxPayload = maxPayload
+
+    def feed(self, data):
+        self.__buffer += data
+
+        frames = []
+        position = 0
+        available = len(self.__buffer)
+        while available - position >= HEADER.size:
+            kind, length = HEADER.unpack_from(self.__buffer, position)
+            if length > self.__maxPayload:
+                raise ValueError("Frame of %s bytes, at most %s expected." % (length, self.__maxPayload))
+
+            end = position + HEADER.size + length
+            if end > available:
+                break
+
+            frames.append((kind, str(self.__buffer[position + HEADER.size:end])))
+            position = end
+
+        del self.__buffer[:position]
+        return frames
+
+
+class LineConfig(object):
+    '''
+    Settings of one line of the gateway, see loadConfig().
+    '''
+
+    def __init__(self, name, port, address):
+        self.name = name
+        self.port = port
+        self.address = address  # see parseAddress()
+        self.baudRate = 9600
+        self.byteSize = LoopBisync.DATABITS_EIGHT
+        self.parity = LoopBisync.PARITY_NONE
+        self.stopBits = LoopBisync.STOPBITS_ONE
+        self.blockCheck = LRC
+        self.blockSize = None
+        self.transparent = False
+        self.role = ROLE_NONE
+        self.highWaterMark = None
+        self.scheduling = SCHEDULING_STRICT
+
+
+def loadConfig(path):
+    '''
+    Reads the gateway's ini file, returns (workers, [LineConfig]). workers is None unless given.
+    Raises ValueError if the file is missing or wrong.
+    '''
+    parser = SafeConfigParser()
+    parser.optionxform = str  # keep the case of baudRate & co.
+    try:
+        if not parser.read(path):
+            raise ValueError("Can not read %s." % path)
+
+        workers = None
+        socketDir = SOCKET_DIR
+        if parser.has_section("gateway"):
+            if parser.has_option("gateway", "workers"):
+                workers = parseNumber(parser, "gateway", "workers")
+                if workers < 1:
+                    raise ValueError("[gateway] workers must be at least 1.")
+
+            if parser.has_option("gateway", "socketDir"):
+                socketDir = parser.get("gateway", "socketDir")
+
+        lines = []
+        for name in parser.sections():
+            if name == "gateway":
+                continue
+
+            if not parser.has_option(name, "port"):
+                raise ValueError("[%s] has no port." % name)
+
+            address = parser.get(name, "listen") if parser.has_option(name, "listen") else \
+                "unix:%s" % os.path.join(socketDir, "%s.sock" % name)
+            parseAddress(address)
+
+            line = LineConfig(name, parser.get(name, "port"), address)
+            if parser.has_option(name, "baudRate"):
+                line.baudRate = parseNumber(parser, name, "baudRate")
+            if parser.has_option(name, "byteSize"):
+                line.byteSize = parseNumber(parser, name, "byteSize")
+            if parser.has_option(name, "parity"):
+                line.parity = parseChoice(parser, name, "parity", PARITIES)
+            if parser.has_option(name, "stopBits"):
+                line.stopBits = parseChoice(parser, name, "stopBits", STOPBITS)
+            if parser.has_option(name, "blockCheck"):
+                line.blockCheck = parseChoice(parser, name, "blockCheck", BLOCK_CHECKS)
+            if parser.has_option(name, "blockSize"):
+                line.blockSize = parseNumber(parser, name, "blockSize")
+            if parser.has_option(name, "transparent"):
+                line.transparent = parseChoice(parser, name, "transparent", BOOLEANS)
+            if parser.has_option(name, "role"):
+                line.role = parseChoice(parser, name, "role", ROLES)
+            if parser.has_option(name, "highWaterMark"):
+                line.highWaterMark = parseNumber(parser, name, "highWaterMark")
+            if parser.has_option(name, "scheduling"):
+                line.scheduling = parseChoice(parser, name, "scheduling", SCHEDULINGS)
+
+            lines.append(line)
+
+    except ConfigError as error:
+        raise ValueError("%s: %s" % (path, error))
+
+    if not lines:
+        raise ValueError("%s: no lines configured." % path)
+
+    addresses = [line.address for line in lines]
+    for address in addresses:
+        if addresses.count(address) > 1:
+            raise ValueError("%s: several lines listen on %s." % (path, address))
+
+    return workers, lines
+
+
+def parseChoice(parser, section, option, choices):
+    value = parser.get(section, option).lower()
+    if value not in choices:
+        raise ValueError("[%s] %s must be one of %s, not %s." % (section, option, ", ".join(sorted(choices)), value))
+
+    return choices[value]
+
+
+def parseNumber(parser, section, option):
+    value = parser.get(section, option)
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError("[%s] %s must be a number, not %s." % (section, option, value))
+
+
+def listen(address):
+    '''
+    A non-blocking listening socket for the address (see parseAddress()), a stale Unix socket file is replaced.
+    '''
+    family, target = parseAddress(address)
+    server = socket.socket(family, socket.SOCK_STREAM)
+    try:
+        if family == socket.AF_UNIX:
+            if os.path.exists(target):
+                os.unlink(target)
+        else:
+            server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+
+        server.bind(target)
+        server.listen(LISTEN_BACKLOG)
+        server.setblocking(False)
+    except Exception:
+        server.close()
+        raise
+
+    return server
+
+
+class ClientConnection(object):
+    '''
+    A client connected to the socket of a line, in the worker owning the line.
+    '''
+
+    def __init__(self, line, loop, connection):
+        self.__line = line
+        self.__loop = loop
+        self.__socket = connection
+        self.__socket.setblocking(False)
+        if connection.family == socket.AF_INET:
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        self.__fd = connection.fileno()
+        self.__reader = FrameReader()
+        self.__txData = ""  # what the socket did not accept yet
+        self.__sequence = 0  # of the last FRAME_WRITE received
+        self.__loop.add_reader(self.__fd, self.__onReadable)
+
+    def __onReadable(self):
+        try:
+            data = self.__socket.recv(RECEIVE_SIZE)
+        except socket.error as error:
+            if error.errno in (errno.EAGAIN, errno.EINTR):
+                return
+
+            self.close()
+            return
+
+        if not data:
+            self.close()
+            return
+
+        try:
+            frames = self.__reader.feed(data)
+        except ValueError as error:
+            logger.warning("%s: %s, client disconnected", self.__line.name, error)
+            self.close()
+            return
+
+        for kind, payload in frames:
+            if kind == FRAME_WRITE:
+                self.__sequence += 1
+                self.__line.write(self, self.__sequence, payload)
+            elif kind == FRAME_WRITE_PRIORITY:
+                self.__sequence += 1
+                priority = PRIORITY.unpack_from(payload)[0] if len(payload) >= PRIORITY.size else None
+                self.__line.write(self, self.__sequence, payload[PRIORITY.size:], priority)
+            # other kinds are not sent by clients, left alone for the sake of newer ones
+
+    def send(self, frame):
+        if self.isClosed:
+            return
+
+        if self.__txData:
+            if len(self.__txData) + len(frame) > MAX_BACKLOG:
+                logger.warning("%s: client does not read, disconnected", self.__line.name)
+                self.close()
+                return
+
+            self.__txData += frame  # the writer callback is already waiting for the socket
+            return
+
+        sent = self.__send(frame)
+        if sent is not None and sent < len(frame):
+            self.__txData = frame[sent:]
+            self.__loop.add_writer(self.__fd, self.__onWritable)
+
+    def __onWritable(self):
+        sent = self.__send(self.__txData)
+        if sent is None:
+            return
+
+        self.__txData = self.__txData[sent:]
+        if not self.__txData:
+            self.__loop.remove_writer(self.__fd)
+
+    def __send(self, data):
+        try:
+            return self.__socket.send(data)
+        except socket.error as error:
+            if error.errno in (errno.EAGAIN, errno.EINTR):
+                return 0
+
+            self.close()
+            return None
+
+    def sendStatus(self, sequence, delivery):
+        if delivery.error is None:
+            self.send(encodeFrame(FRAME_DELIVERED, SEQUENCE.pack(sequence)))
+        else:
+            self.send(encodeFrame(FRAME_FAILED, SEQUENCE.pack(sequence) + encodeError(delivery.error)))
+
+    def close(self):
+        if self.isClosed:
+            return
+
+        self.__loop.remove_reader(self.__fd)
+        if self.__txData:
+            self.__loop.remove_writer(self.__fd)
+            self.__txData = ""
+
+        self.__socket.close()
+        self.__socket = None
+        self.__line.detach(self)
+
+    @property
+    def isClosed(self):
+        return self.__socket is None
+
+
+class GatewayLine(object):
+    '''
+    One line of the gateway: the port and the clients connected to the line's socket.
+    What the port reads and its errors go to every client, the delivery status of a message only to its writer.
+    '''
+
+    def __init__(self, loop, config):
+        self.name = config.name
+        self.config = config
+        self.__loop = loop
+        self.__clients = set()
+
+        self.port = LoopBisync(loop, blockCheck=config.blockCheck())
+        self.port.port = config.port
+        self.port.baudRate = config.baudRate
+        self.port.byteSize = config.byteSize
+        self.port.parity = config.parity
+        self.port.stopBits = config.stopBits
+        self.port.blockSize = config.blockSize
+        self.port.transparent = config.transparent
+        self.port.role = config.role
+        self.port.messages.highWaterMark = config.highWaterMark
+        self.port.messages.scheduling = config.scheduling
+        self.port.onRead = self.__onRead
+        self.port.onError = self.__onError
+
+        self.__server = listen(config.address)
+        self.__loop.add_reader(self.__server.fileno(), self.__onAcceptable)
+        self.__reopenTimer = None
+
+    def open(self):
+        '''
+        Opens the port, tries again every REOPEN_INTERVAL if it can not be opened.
+        '''
+        self.__reopenTimer = None
+        try:
+            self.port.open()
+        except (IOError, OSError, ValueError) as error:
+            logger.warning("%s: %s, next attempt in %s ms", self.name, error, REOPEN_INTERVAL)
+            self.__reopenTimer = self.port.scheduler.callLater(REOPEN_INTERVAL, self.open)
+            return
+
+        logger.info("%s: %s open, listening on %s", self.name, self.config.port, self.config.address)
+
+    def close(self):
+        if self.__reopenTimer is not None:
+            self.__reopenTimer.cancel()
+            self.__reopenTimer = None
+
+        for client in list(self.__clients):
+            client.close()
+
+        self.__loop.remove_reader(self.__server.fileno())
+        self.__server.close()
+        family, target = parseAddress(self.config.address)
+        if family == socket.AF_UNIX and os.path.exists(target):
+            os.unlink(target)
+
+        self.port.close()
+
+    def __onAcceptable(self):
+        try:
+            connection, _ = self.__server.accept()
+        except socket.error as error:
+            if error.errno in (errno.EAGAIN, errno.EINTR, errno.ECONNABORTED):
+                return
+            raise
+
+        self.__clients.add(ClientConnection(self, self.__loop, connection))
+
+    def detach(self, client):
+        self.__clients.discard(client)
+
+    def write(self, client, sequence, payload, priority=PRIORITY_NORMAL):
+        if priority is None or priority >= PRIORITY_LEVELS:
+            # "Unknown error", no such priority
+            errorCode = -1
+            client.send(encodeFrame(FRAME_FAILED, SEQUENCE.pack(sequence) +
+                                    encodeError((errorCode, self.port.errorString(errorCode)))))
+            return
+
+        try:
+            deliveries = self.port.write(bytearray(payload), priority)
+        except QueueOverflowError:
+            # "Outbound queue overflow, message dropped"
+            errorCode = 9
+            client.send(encodeFrame(FRAME_FAILED, SEQUENCE.pack(sequence) +
+                                    encodeError((errorCode, self.port.errorString(errorCode)))))
+            return
+
+        if not deliveries:  # empty message
+            errorCode = -1
+            client.send(encodeFrame(FRAME_FAILED, SEQUENCE.pack(sequence) +
+                                    encodeError((errorCode, self.port.errorString(errorCode)))))
+            return
+
+        deliveries[0].addCallback(lambda delivery: client.sendStatus(sequence, delivery))
+
+    def __broadcast(self, frame):
+        for client in list(self.__clients):
+            client.send(frame)
+
+    def __onRead(self, message):
+        self.__broadcast(encodeFrame(FRAME_READ, message))
+
+    def __onError(self, error):
+        self.__broadcast(encodeFrame(FRAME_ERROR, encodeError(error)))
+
+    @property
+    def clients(self):
+        return len(self.__clients)
+
+
+def runWorker(configs):
+    '''
+    Body of a worker process: serves the lines on an event loop of its own until SIGTERM.
+    '''
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl-C is the gateway's business, it stops the workers
+    loop = newLoop()
+    loop.add_signal_handler(signal.SIGTERM, loop.stop)
+
+    lines = []
+    try:
+        for config in configs:
+            lines.append(GatewayLine(loop, config))
+
+        for line in lines:
+            line.open()
+
+        loop.run_forever()
+    finally:
+        for line in lines:
+            line.close()
+
+        loop.close()
+
+
+class Gateway(object):
+    '''
+    Spreads the lines over worker processes and starts again the ones that die.
+    '''
+
+    def __init__(self, lines, workers=None):
+        self.lines = lines
+        self.workerCount = max(1, min(workers or multiprocessing.cpu_count(), len(lines)))
+        self.__workers = []  # [process, lines]
+        self.__stopping = False
+
+    def start(self):
+        for index in xrange(self.workerCount):
+            lines = self.lines[index::self.workerCount]
+            self.__workers.append([self.__spawn(lines), lines])
+
+    def __spawn(self, lines):
+        process = multiprocessing.Process(target=runWorker, args=(lines,),
+                                          name="rbisync-gateway: %s" % ", ".join(line.name for line in lines))
+        process.daemon = True
+        process.start()
+        logger.info("worker %s started for %s", process.pid, ", ".join(line.name for line in lines))
+
+        return process
+
+    def run(self):
+        '''
+        Starts the workers and looks after them until SIGTERM or SIGINT.
+        '''
+        def onSignal(signum, frame):
+            self.__stopping = True
+
+        signal.signal(signal.SIGTERM, onSignal)
+        signal.signal(signal.SIGINT, onSignal)
+
+        self.start()
+        try:
+            while not self.__stopping:
+                time.sleep(RESPAWN_INTERVAL)
+                for worker in self.__workers:
+                    process, lines = worker
+                    if not process.is_alive() and not self.__stopping:
+                        logger.warning("worker %s exited with %s, restarting", process.pid, process.exitcode)
+                        worker[0] = self.__spawn(lines)
+        finally:
+            self.stop()
+
+    def stop(self):
+        self.__stopping = True
+        for process, _ in self.__workers:
+            if process.is_alive():
+                process.terminate()
+
+        for process, _ in self.__workers:
+            process.join()
+
+        self.__workers = []
+
+
+class GatewayClient(object):
+    '''
+    Blocking client of one line of the gateway.
+    write() sends a message and returns its sequence number; receive() returns the next event:
+    (FRAME_READ, message), (FRAME_ERROR, (code, description)), (FRAME_DELIVERED, sequence) or
+    (FRAME_FAILED, (sequence, (code, description))).
+    '''
+
+    def __init__(self, address, timeout=None):
+        family, target = parseAddress(address)
+        self.__socket = socket.socket(family, socket.SOCK_STREAM)
+        self.__socket.settimeout(timeout)
+        try:
+            self.__socket.connect(target)
+        except Exception:
+            self.__socket.close()
+            raise
+
+        if family == socket.AF_INET:
+            self.__socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        self.__reader = FrameReader()
+        self.__events = deque()
+        self.__sequence = 0
+
+    def write(self, message, priority=None):
+        '''
+        priority (PRIORITY_URGENT, PRIORITY_NORMAL or PRIORITY_BULK) sends FRAME_WRITE_PRIORITY, None FRAME_WRITE.
+        '''
+        message = memoryview(message).tobytes()
+        if not message:
+            raise ValueError("Empty message.")
+
+        if priority is None:
+            self.__socket.sendall(encodeFrame(FRAME_WRITE, message))
+        else:
+            self.__socket.sendall(encodeFrame(FRAME_WRITE_PRIORITY, PRIORITY.pack(priority) + message))
+        self.__sequence += 1
+
+        return self.__sequence
+
+    def receive(self, timeout=None):
+        '''
+        The next event, None if none came within timeout seconds (None: wait for ever).
+        Raises EOFError once the gateway has closed the connection.
+        '''
+        self.__socket.settimeout(timeout)
+        while not self.__events:
+            try:
+                data = self.__socket.recv(RECEIVE_SIZE)
+            except socket.timeout:
+                return None
+
+            if not data:
+                raise EOFError("Gateway closed the connection.")
+
+            for kind, payload in self.__reader.feed(data):
+                self.__events.append(self.__event(kind, payload))
+
+        return self.__events.popleft()
+
+    @staticmethod
+    def __event(kind, payload):
+        if kind == FRAME_ERROR:
+            return kind, decodeError(payload)
+
+        if kind == FRAME_DELIVERED:
+            return kind, SEQUENCE.unpack_from(payload)[0]
+
+        if kind == FRAME_FAILED:
+            return kind, (SEQUENCE.unpack_from(payload)[0], decodeError(payload[SEQUENCE.size:]))
+
+        return kind, payload
+
+    def fileno(self):
+        return self.__socket.fileno()
+
+    def close(self):
+        self.__socket.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serves BSC lines to local clients over Unix or TCP sockets.")
+    parser.add_argument("config", help="ini file with a section per line")
+    parser.add_argument("-w", "--workers", type=int, help="worker processes, overrides [gateway] workers")
+    parser.add_argument("-v", "--verbose", action="store_true", help="log the lines opening and the workers")
+    arguments = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if arguments.verbose else logging.WARNING, stream=sys.stderr,
+                        format="%(asctime)s %(processName)s: %(message)s")
+    if arguments.verbose:
+        logging.disable(logging.NOTSET)  # protocol disables INFO unless protocol.DEBUG
+
+    try:
+        workers, lines = loadConfig(arguments.config)
+    except ValueError as error:
+        print >> sys.stderr, error
+        sys.exit(1)
+
+    Gateway(lines, arguments.workers or workers).run()
+
+
+if __name__ == "__main__":
+    main()
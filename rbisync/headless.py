@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2015-2016 Alexey Naumov <rocketbuzzz@gmail.com>
+#
+# This file is part of rbisync.
+#
+# rbisync is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import errno
+import termios
+from protocol import AbstractBisync
+from scheduler import LoopScheduler, TimerWheel
+
+READ_SIZE = 4096  # bytes read from the port at once
+
+CMSPAR = getattr(termios, "CMSPAR", 010000000000)  # "stick" parity, missing from termios on older Pythons
+
+SCHEDULERS = {}  # key=loop, value=the timer wheel shared by all the ports running in the loop
+
+
+def asyncioModule():
+    try:
+        import asyncio
+    except ImportError:
+        import trollius as asyncio
+
+    return asyncio
+
+
+def defaultLoop():
+    return asyncioModule().get_event_loop()
+
+
+def newLoop():
+    '''
+    A new loop, made the current one: for a process (see gateway) or a thread of its own.
+    '''
+    asyncio = asyncioModule()
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    return loop
+
+
+def defaultScheduler(loop):
+    scheduler = SCHEDULERS.get(loop)
+    if scheduler is None:
+        scheduler = SCHEDULERS[loop] = TimerWheel(LoopScheduler(loop))
+
+    return scheduler
+
+
+class LoopBisync(AbstractBisync):
+    '''
+    Binary synchronous communications over a serial port without Qt.
+    The port is read with loop.add_reader(), the timeouts are run by loop.call_later().
+    Any asyncio compatible loop (asyncio, trollius) will do.
+    '''
+
+    PARITY_NONE, PARITY_EVEN, PARITY_ODD, PARITY_MARK, PARITY_SPACE = range(5)
+    STOPBITS_ONE, STOPBITS_ONE_POINT_FIVE, STOPBITS_TWO = range(3)
+    DATABITS_FIVE, DATABITS_SIX, DATABITS_SEVEN, DATABITS_EIGHT = (5, 6, 7, 8)
+
+    def __init__(self, loop=None, scheduler=None, blockCheck=None):
+        self.__loop = loop if loop is not None else defaultLoop()
+        AbstractBisync.__init__(self, scheduler if scheduler is not None else defaultScheduler(self.__loop), blockCheck)
+
+        self.port = None
+        self.baudRate = 9600
+        self.byteSize = LoopBisync.DATABITS_EIGHT
+        self.parity = LoopBisync.PARITY_NONE
+        self.stopBits = LoopBisync.STOPBITS_ONE
+
+        self.__fd = None
+        self.__txData = ""  # what the port did not accept yet
+
+    def open(self):
+        if self.isOpen:
+            raise IOError("Port %s is already open." % self.port)
+
+        speed = getattr(termios, "B%s" % self.baudRate, None)
+        if speed is None:
+            raise IOError("Baud rate %s is not supported." % self.baudRate)
+
+        try:
+            fd = os.open(str(self.port), os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+        except OSError as error:
+            raise IOError("Can not open port %s: %s" % (self.port, error.strerror))
+
+        try:
+            self.__configure(fd, speed)
+        except (termios.error, ValueError):
+            os.close(fd)
+            raise
+
+        self.__fd = fd
+        self.__loop.add_reader(self.__fd, self.__onReadable)
+        self.bid()  # for what was written while the port was closed
+
+    def close(self):
+        if not self.isOpen:
+            return
+
+        self.reset()
+
+        self.__loop.remove_reader(self.__fd)
+        if self.__txData:
+            self.__loop.remove_writer(self.__fd)
+            self.__txData = ""
+
+        os.close(self.__fd)
+        self.__fd = None
+
+    def __configure(self, fd, speed):
+        iflag, oflag, cflag, lflag, ispeed, ospeed, cc = termios.tcgetattr(fd)
+
+        byteSize = {5: termios.CS5, 6: termios.CS6, 7: termios.CS7, 8: termios.CS8}.get(self.byteSize)
+        if byteSize is None:
+            raise ValueError("Invalid byte size %s." % self.byteSize)
+
+        # raw mode: no echo, no line editing, no translations
+        iflag = termios.IGNBRK
+        oflag = 0
+        lflag = 0
+        cflag = termios.CREAD | termios.CLOCAL | byteSize
+
+        if self.stopBits in (LoopBisync.STOPBITS_ONE_POINT_FIVE, LoopBisync.STOPBITS_TWO):
+            cflag |= termios.CSTOPB  # termios knows no 1.5 stop bits
+
+        if self.parity == LoopBisync.PARITY_EVEN:
+            cflag |= termios.PARENB
+        elif self.parity == LoopBisync.PARITY_ODD:
+            cflag |= termios.PARENB | termios.PARODD
+        elif self.parity == LoopBisync.PARITY_MARK:
+            cflag |= termios.PARENB | CMSPAR | termios.PARODD
+        elif self.parity == LoopBisync.PARITY_SPACE:
+            cflag |= termios.PARENB | CMSPAR
+        elif self.parity != LoopBisync.PARITY_NONE:
+            raise ValueError("Invalid parity %s." % self.parity)
+
+        cc[termios.VMIN] = 0
+        cc[termios.VTIME] = 0
+
+        termios.tcsetattr(fd, termios.TCSANOW, [iflag, oflag, cflag, lflag, speed, speed, cc])
+        termios.tcflush(fd, termios.TCIOFLUSH)
+
+    def __onReadable(self):
+        try:
+            data = os.read(self.__fd, READ_SIZE)
+        except OSError as error:
+            if error.errno in (errno.EAGAIN, errno.EINTR):
+                return
+            raise
+
+        if data:
+            self._receive(data)
+
+    def __onWritable(self):
+        written = self.__send(self.__txData)
+        self.__txData = self.__txData[written:]
+        if not self.__txData:
+            self.__loop.remove_writer(self.__fd)
+
+    def __send(self, data):
+        try:
+            return os.write(self.__fd, data)
+        except OSError as error:
+            if error.errno in (errno.EAGAIN, errno.EINTR):
+                return 0
+            raise
+
+    def _transmit(self, data):
+        # data may be a memoryview of the frame buffer, it is written as is and only the rest the port
+        # did not take is copied
+        if not self.isOpen:
+            raise IOError("Port is not open.")
+
+        if self.__txData:
+            self.__txData += memoryview(data).tobytes()  # the writer callback is already waiting for the port
+            return
+
+        written = self.__send(data)
+        if written < len(data):
+            self.__txData = memoryview(data)[written:].tobytes()
+            self.__loop.add_writer(self.__fd, self.__onWritable)
+
+    @property
+    def isOpen(self):
+        return self.__fd is not None
+
+    @property
+    def loop(self):
+        return self.__loop
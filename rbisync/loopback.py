@@ -0,0 +1,812 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2015-2016 Alexey Naumov <rocketbuzzz@gmail.com>
+#
+# This file is part of rbisync.
+#
+# rbisync is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import time
+import random
+import ctypes
+import tempfile
+import multiprocessing
+import argparse
+import itertools
+import threading
+import functools
+from protocol import AbstractBisync, ENQ, ACK, STX, ETX, EOT, STATE_IDLE, STATE_RX_FINISHED
+from protocol import ROLE_NONE, ROLE_PRIMARY, ROLE_SECONDARY
+from decoder import FrameDecoder
+from capture import Replayer, RECORD_RX
+from outbound import DELIVERY_DELIVERED
+from scheduler import AbstractScheduler, SchedScheduler, VirtualScheduler, TimerWheel
+from blockcheck import LRC, CRC16
+from rtt import BITS_PER_CHARACTER
+
+BENCHMARK_COUNT = 100  # messages sent per profile
+BENCHMARK_SIZE = 32  # (bytes) of every message
+UART_FIFO = 16  # characters a paced line delivers at once, like the receive FIFO of a 16550
+BENCHMARK_PRODUCERS = 4  # threads submitting messages at once
+DECODE_SIZES = (10, 100, 1024, 4096, 16384, 65536)  # (bytes) frame sizes for --decode
+DECODE_BYTES = 1 << 20  # (bytes) decoded per frame size, small frames are repeated to make it up
+READ_CHUNK = 4096  # characters a serial driver hands over at once at high speed
+TIMER_LINES = 500  # lines sharing one timer wheel for --timers
+CHECK_SIZES = (1024, 16384, 65536, 262144, 1048576)  # (bytes) payload sizes for --checks
+CHECK_BYTES = 1 << 21  # (bytes) checked per payload size, small payloads are repeated to make it up
+MEMORY_SIZE = 1 << 24  # (bytes) of the message for --memory, big enough for its copies to stand out in the peak
+M_MMAP_THRESHOLD = -3  # mallopt() parameter of glibc
+MMAP_THRESHOLD = 1 << 17  # (bytes) blocks from that size up are mapped and unmapped, not kept for reuse
+MEMORY_CASES = ("receive, onRead gets str", "receive, onRead gets memoryview", "send str", "send bytearray")
+
+
+class LinkProfile(object):
+    '''
+    Conditions on a LoopbackLink.
+    loss and corruption are probabilities per byte, nakRate per message received by the SimulatedPeer,
+    collision per bid the SimulatedPeer sees. latency is in ms, a baudRate of None means no pacing.
+    '''
+
+    def __init__(self, baudRate=None, latency=0, loss=0.0, corruption=0.0, nakRate=0.0, collision=0.0):
+        self.baudRate = baudRate
+        self.latency = latency
+        self.loss = loss
+        self.corruption = corruption
+        self.nakRate = nakRate
+        self.collision = collision
+
+
+PROFILES = {"ideal": LinkProfile(),
+            "lan": LinkProfile(baudRate=115200, latency=1),
+            "modem": LinkProfile(baudRate=9600, latency=10),
+            "noisy": LinkProfile(baudRate=9600, latency=10, loss=0.0001, corruption=0.0001, nakRate=0.02),
+            "contended": LinkProfile(baudRate=19200, latency=2, collision=0.1)}
+
+
+class LoopbackLink(object):
+    '''
+    In-memory full duplex line between two stations.
+    Every chunk transmitted takes len * 11 bits at the profile's baud rate plus the latency to reach the other end,
+    chunks sent in one direction never overtake each other. A paced line delivers the characters UART_FIFO at a time
+    as they come in, the receiver sees the start of a long frame before its end.
+    The random generator is seeded for reproducible runs.
+    '''
+
+    def __init__(self, scheduler, profile=None, seed=None):
+        self.scheduler = scheduler
+        self.profile = profile if profile is not None else LinkProfile()
+        self.random = random.Random(seed)
+        self.__stations = []
+        self.__busy = {}  # key=station, value=(ms) when it is done transmitting what it has sent so far
+
+    def attach(self, station):
+        if len(self.__stations) == 2:
+            raise ValueError("A link connects two stations.")
+
+        self.__stations.append(station)
+
+    def send(self, station, data):
+        data = memoryview(data).tobytes()  # the frame buffer is reused as soon as _transmit() returns
+        profile = self.profile
+
+        now = self.scheduler.now()
+        characterTime = self.characterTime
+        start = max(now, self.__busy.get(station, now))
+        self.__busy[station] = start + len(data) * characterTime
+
+        if profile.loss or profile.corruption:
+            data = self.__impair(data)  # lost characters still took their time on the line
+            if not data:
+                return
+
+        peer = self.__stations[1] if station is self.__stations[0] else self.__stations[0]
+        piece = UART_FIFO if characterTime else len(data)
+        for offset in xrange(0, len(data), piece):
+            chunk = data[offset:offset + piece]
+            arrival = start + (offset + len(chunk)) * characterTime + profile.latency
+            self.scheduler.callLater(arrival - now, lambda chunk=chunk: peer._receive(chunk))
+
+    def __impair(self, data):
+        chance = self.random.random
+        data = bytearray(data)
+        if self.profile.loss:
+            data = bytearray(byte for byte in data if chance() >= self.profile.loss)
+
+        if self.profile.corruption:
+            for index in xrange(len(data)):
+                if chance() < self.profile.corruption:
+                    data[index] ^= 1 << self.random.randrange(8)
+
+        return str(data)
+
+    @property
+    def characterTime(self):
+        '''
+        (ms) one character takes on the line, 0 if the line is not paced.
+        '''
+        if not self.profile.baudRate:
+            return 0
+
+        return BITS_PER_CHARACTER * 1000.0 / self.profile.baudRate
+
+
+class LoopbackPort(AbstractBisync):
+    '''
+    Bisync over one end of a LoopbackLink, runs in the link's scheduler unless given one of its own
+    (a TimerWheel over the link's scheduler, say).
+    '''
+
+    def __init__(self, link, blockCheck=None, scheduler=None):
+        AbstractBisync.__init__(self, scheduler if scheduler is not None else link.scheduler, blockCheck)
+        self.baudRate = link.profile.baudRate
+        self.timeouts.random = link.random  # with a VirtualScheduler the whole run depends on the seed only
+        self.__link = link
+        link.attach(self)
+
+    def _transmit(self, data):
+        self.__link.send(self, data)
+
+    @property
+    def link(self):
+        return self.__link
+
+
+class SimulatedPeer(LoopbackPort):
+    '''
+    The station at the other end of the line. Reads everything it is sent and, as often as the link profile says,
+    answers a message with NAK or answers a bid with a bid of its own (a collision).
+    '''
+
+    def __init__(self, link, blockCheck=None, scheduler=None):
+        LoopbackPort.__init__(self, link, blockCheck, scheduler)
+        self.receivedCount = 0
+        self.nakCount = 0
+        self.collisionCount = 0
+        self.onRead = self.__onRead
+
+    def __onRead(self, message):
+        self.receivedCount += 1
+
+    def _receive(self, data):
+        profile = self.link.profile
+        if data == ENQ and self.state == STATE_IDLE and profile.collision and self.link.random.random() < profile.collision:
+            self.collisionCount += 1
+            self._transmit(ENQ)
+            return
+
+        LoopbackPort._receive(self, data)
+
+    def writeACK(self, ack=ACK):
+        profile = self.link.profile
+        if self.state == STATE_RX_FINISHED and profile.nakRate and self.link.random.random() < profile.nakRate:
+            self.nakCount += 1
+            self._enter(STATE_IDLE)
+            self.writeNAK()
+            return
+
+        LoopbackPort.writeACK(self, ack)
+
+
+class TracedTimer(object):
+    def __init__(self, trace, number, timer):
+        self.__trace = trace
+        self.__number = number
+        self.__timer = timer
+
+    def cancel(self):
+        self.__trace.cancelled(self.__number)
+        self.__timer.cancel()
+
+
+class TimerTrace(AbstractScheduler):
+    '''
+    Passes the timers on to the scheduler underneath and records every one armed and cancelled,
+    so the timer load of a run can be replayed on its own, see replayTimers().
+    '''
+
+    def __init__(self, scheduler):
+        self.__scheduler = scheduler
+        self.operations = []  # (ms, timer number, interval) of every callLater(), interval None for cancel()
+        self.__sequence = itertools.count()
+
+    def callLater(self, interval, callback):
+        number = next(self.__sequence)
+        self.operations.append((self.__scheduler.now(), number, interval))
+        return TracedTimer(self, number, self.__scheduler.callLater(interval, callback))
+
+    def cancelled(self, number):
+        self.operations.append((self.__scheduler.now(), number, None))
+
+    def now(self):
+        return self.__scheduler.now()
+
+
+class DiscardingPort(AbstractBisync):
+    '''
+    Bisync whose transmissions go nowhere, for feeding it generated or recorded traffic (see Replayer.replay()).
+    '''
+
+    def __init__(self, scheduler, blockCheck=None):
+        AbstractBisync.__init__(self, scheduler, blockCheck)
+
+    def _transmit(self, data):
+        pass
+
+
+def percentile(values, percent):
+    '''
+    Nearest rank percentile of the sorted values, None if there are none.
+    '''
+    if not values:
+        return None
+
+    return values[min(len(values) - 1, int(round(percent / 100.0 * (len(values) - 1))))]
+
+
+def runBenchmark(profile, count=BENCHMARK_COUNT, size=BENCHMARK_SIZE, window=1, blockCheck=None, seed=0, virtual=False):
+    '''
+    Sends count messages of size bytes from a LoopbackPort to a SimulatedPeer, at most window of them queued at once,
+    and returns the figures as a dict. Latencies are write() to ACK in ms, cpuPerMessage is in ms too.
+    If virtual is set the line runs on a VirtualScheduler: the run takes only the CPU time it needs,
+    the rates and latencies are in simulated time.
+    '''
+    scheduler = VirtualScheduler() if virtual else SchedScheduler()
+    link = LoopbackLink(scheduler, profile, seed)
+    station = LoopbackPort(link, blockCheck)
+    peer = SimulatedPeer(link, blockCheck)
+
+    payload = bytearray("U" * size)
+    deliveries = []
+    sequence = itertools.count(count - 1, -1)
+    finished = [None]
+
+    def sendNext(delivery=None):
+        if len(deliveries) == count and all(item.done for item in deliveries):
+            finished[0] = scheduler.now()
+
+        if next(sequence) >= 0:
+            delivery = station.write(payload)[0]
+            deliveries.append(delivery)
+            delivery.addCallback(sendNext)
+
+    started = scheduler.now()
+    cpu = time.clock()
+    for _ in xrange(max(window, 1)):
+        sendNext()
+
+    scheduler.run()
+    cpu = time.clock() - cpu
+    elapsed = ((finished[0] or scheduler.now()) - started) / 1000.0
+    if not virtual:
+        scheduler.close()
+
+    latencies = sorted(item.latency for item in deliveries if item.status == DELIVERY_DELIVERED)
+    return {"messages": count,
+            "delivered": len(latencies),
+            "failed": count - len(latencies),
+            "elapsed": elapsed,
+            "messagesPerSecond": len(latencies) / elapsed if elapsed else None,  # no time passes on an ideal line
+            "bytesPerSecond": len(latencies) * size / elapsed if elapsed else None,  # in virtual time, no rate then
+            "latency50": percentile(latencies, 50),
+            "latency99": percentile(latencies, 99),
+            "cpuPerMessage": cpu * 1000.0 / count if count else 0.0,
+            "naks": peer.nakCount,
+            "collisions": peer.collisionCount}
+
+
+def replayTimers(operations, wheel):
+    '''
+    Arms and cancels the timers of a TimerTrace at the times they were on a fresh VirtualScheduler, with a
+    TimerWheel over it if wheel is set. Returns (CPU seconds, timers armed and cancelled on the
+    VirtualScheduler, callbacks it fired): with nothing else running, that is the cost of the timer
+    subsystem alone. On the plain heap every timer is armed and cancelled on the event loop itself, as
+    with a timer per handle, and it wakes the loop only if it is not cancelled before it is due.
+    '''
+    base = VirtualScheduler()
+    scheduler = TimerWheel(base) if wheel else base
+    timers = {}
+    idle = lambda: None
+
+    cpu = time.clock()
+    for at, number, interval in operations:
+        if at > base.now():
+            base.advance(at - base.now())
+
+        if interval is None:
+            timers.pop(number).cancel()
+        else:
+            timers[number] = scheduler.callLater(interval, idle)
+
+    base.run()
+    cpu = time.clock() - cpu
+
+    # the wheel arms one timer of the event loop per tick and never cancels it, the heap all of them
+    return cpu, base.firedCount if wheel else len(operations), base.firedCount
+
+
+def runTimerBenchmark(profile, lines=TIMER_LINES, count=BENCHMARK_COUNT, size=BENCHMARK_SIZE, seed=0):
+    '''
+    Runs lines stations, each sending count messages to a SimulatedPeer over a line of its own, with the
+    timers of all the ports on one TimerWheel and everything on a VirtualScheduler. The timers armed on
+    the way are then replayed on the wheel and on the plain heap of the VirtualScheduler, one heap entry
+    per timer as it was with a timer per handle. Returns a dict: the run's figures and, per scheduler,
+    the CPU time of the timer subsystem, the timers it armed and cancelled on the event loop and the times
+    it woke up.
+    '''
+    base = VirtualScheduler()
+    trace = TimerTrace(TimerWheel(base))
+    deliveries = []
+    for number in xrange(lines):
+        link = LoopbackLink(base, profile, seed + number)
+        station = LoopbackPort(link, scheduler=trace)
+        SimulatedPeer(link, scheduler=trace)
+        deliveries.extend(station.write([bytearray("U" * size) for _ in xrange(count)]))
+
+    cpu = time.clock()
+    base.run()
+    cpu = time.clock() - cpu
+
+    armed = sum(1 for _, _, interval in trace.operations if interval is not None)
+    result = {"lines": lines,
+              "delivered": sum(1 for delivery in deliveries if delivery.status == DELIVERY_DELIVERED),
+              "messages": len(deliveries),
+              "elapsed": base.now() / 1000.0,
+              "cpu": cpu,
+              "armed": armed,
+              "cancelled": len(trace.operations) - armed}
+
+    for name, wheel in (("heap", False), ("wheel", True)):
+        result[name] = dict(zip(("cpu", "loopTimers", "wakeups"), replayTimers(trace.operations, wheel)))
+
+    return result
+
+
+def runContentionBenchmark(profile, roles, count=BENCHMARK_COUNT, size=BENCHMARK_SIZE, seed=0):
+    '''
+    Two LoopbackPorts with the given (role, role) both queue count messages of size bytes at once and bid
+    for the line until all of them are through, in simulated time. Returns the figures as a dict,
+    goodput is the payload delivered both ways per second.
+    '''
+    scheduler = VirtualScheduler()
+    link = LoopbackLink(scheduler, profile, seed)
+    ports = [LoopbackPort(link), LoopbackPort(link)]
+    errors = []
+    deliveries = []
+    for port, role in zip(ports, roles):
+        port.role = role
+        port.enableMetrics()
+        port.onError = errors.append
+
+    for port in ports:
+        deliveries.extend(port.write([bytearray("U" * size) for _ in xrange(count)]))
+
+    scheduler.run()
+    elapsed = scheduler.now() / 1000.0
+    delivered = sum(1 for delivery in deliveries if delivery.status == DELIVERY_DELIVERED)
+
+    return {"messages": len(deliveries),
+            "delivered": delivered,
+            "elapsed": elapsed,
+            "goodput": delivered * size / elapsed if elapsed else None,
+            "collisions": sum(port.metrics.collisions for port in ports),
+            "errors": len(errors)}
+
+
+def runReceiveBenchmark(count=BENCHMARK_COUNT, size=BENCHMARK_SIZE, chunk=UART_FIFO, blockCheck=None):
+    '''
+    Feeds count ENQ, message, EOT exchanges to a port, chunk characters per read, and returns the CPU time
+    the port spends per character received, in microseconds.
+    '''
+    scheduler = VirtualScheduler()
+    port = DiscardingPort(scheduler, blockCheck)
+    received = []
+    port.onRead = received.append
+
+    blockCheck = port.blockCheck
+    payload = "U" * size
+    frame = STX + payload + ETX + blockCheck.encode(blockCheck.update(blockCheck.compute(payload), ETX))
+    chunks = [ENQ] + [frame[start:start + chunk] for start in xrange(0, len(frame), chunk)] + [EOT]
+    characters = count * sum(len(item) for item in chunks)
+
+    cpu = time.clock()
+    for _ in xrange(count):
+        for item in chunks:
+            port._receive(item)
+        scheduler.advance(0)
+    cpu = time.clock() - cpu
+
+    if len(received) != count:
+        raise RuntimeError("%s messages of %s received." % (len(received), count))
+
+    return cpu * 1000000.0 / characters
+
+
+def runDecodeBenchmark(sizes=DECODE_SIZES, chunk=READ_CHUNK, blockCheck=None):
+    '''
+    Feeds frames of every size to a FrameDecoder, chunk characters per feed(), and returns
+    [(size, us per byte, us per frame)]. The decoder looks at every byte once, so the time per byte should
+    not grow with the frame size.
+    '''
+    blockCheck = blockCheck if blockCheck is not None else LRC()
+    results = []
+    for size in sizes:
+        decoder = FrameDecoder(blockCheck)
+        received = []
+        decoder.onFrame = lambda message, checksumLocal, checksumRemote, final: received.append(len(message))
+
+        payload = "U" * size
+        frame = STX + payload + ETX + blockCheck.encode(blockCheck.update(blockCheck.compute(payload), ETX))
+        chunks = [frame[start:start + chunk] for start in xrange(0, len(frame), chunk)]
+        count = max(DECODE_BYTES // size, 1)
+
+        cpu = time.clock()
+        for _ in xrange(count):
+            for item in chunks:
+                position = 0
+                while position < len(item):
+                    position += decoder.feed(item[position:] if position else item)
+        cpu = time.clock() - cpu
+
+        if received != [size] * count:
+            raise RuntimeError("%s frames of %s decoded." % (len(received), count))
+
+        results.append((size, cpu * 1000000.0 / (count * len(frame)), cpu * 1000000.0 / count))
+
+    return results
+
+
+def recordCapture(path, profile, count=BENCHMARK_COUNT, size=BENCHMARK_SIZE, seed=0):
+    '''
+    Records to path what a LoopbackPort receives from a SimulatedPeer sending it count messages of size bytes.
+    '''
+    scheduler = VirtualScheduler()
+    link = LoopbackLink(scheduler, profile, seed)
+    station = LoopbackPort(link)
+    peer = SimulatedPeer(link)
+
+    station.startCapture(path)
+    try:
+        peer.write([bytearray("U" * size) for _ in xrange(count)])
+        scheduler.run()
+    finally:
+        station.stopCapture()
+
+
+def runCaptureBenchmark(path, repeat=10):
+    '''
+    Replays the received chunks of the capture at path into a port repeat times, once as they were read and
+    once a byte per read, the way they were dispatched before the receive path took whole chunks.
+    Returns (bytes, bytes per second as read, bytes per second a byte at a time).
+    '''
+    chunks = [data for _, kind, data in Replayer(path).records() if kind == RECORD_RX]
+    total = sum(len(data) for data in chunks)
+    rates = []
+    counts = []
+    for perByte in (False, True):
+        scheduler = VirtualScheduler()
+        port = DiscardingPort(scheduler)
+        received = []
+        port.onRead = received.append
+
+        cpu = time.clock()
+        for _ in xrange(repeat):
+            for data in chunks:
+                if perByte:
+                    for index in xrange(len(data)):
+                        port._receive(data[index])
+                else:
+                    port._receive(data)
+                scheduler.advance(0)
+        cpu = time.clock() - cpu
+
+        rates.append(repeat * total / cpu if cpu else None)
+        counts.append(len(received))
+
+    if counts[0] != counts[1]:
+        raise RuntimeError("The replays received %s and %s messages." % tuple(counts))
+
+    return total, rates[0], rates[1]
+
+
+def runBlockCheckBenchmark(blockCheck, sizes=CHECK_SIZES, seed=0):
+    '''
+    Computes the block check over random payloads of every size, and returns [(size, bytes per second)].
+    '''
+    generator = random.Random(seed)
+    results = []
+    for size in sizes:
+        payload = memoryview(bytearray(generator.getrandbits(8) for _ in xrange(size)))
+        count = max(CHECK_BYTES // size, 1)
+
+        cpu = time.clock()
+        for _ in xrange(count):
+            blockCheck.compute(payload)
+        cpu = time.clock() - cpu
+
+        results.append((size, count * size / cpu if cpu else None))
+
+    return results
+
+
+def readStatus(field):
+    # (KB) a field of /proc/self/status
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+
+
+def measureMemory(case, size, results):
+    # one of MEMORY_CASES, in a process of its own so that the heap of a case does not serve the next
+    try:
+        ctypes.CDLL(None).mallopt(M_MMAP_THRESHOLD, MMAP_THRESHOLD)  # glibc gives big blocks back when freed
+    except (OSError, AttributeError):
+        pass
+
+    port = DiscardingPort(VirtualScheduler())
+    port.zeroCopy = case == "receive, onRead gets memoryview"
+    port.onRead = lambda message: None
+
+    payload = "U" * size  # no whitespace: a single message in text mode
+    if case.startswith("receive"):
+        blockCheck = port.blockCheck
+        frame = STX + payload + ETX + blockCheck.encode(blockCheck.update(blockCheck.compute(payload), ETX))
+        chunks = [ENQ] + [frame[start:start + READ_CHUNK] for start in xrange(0, len(frame), READ_CHUNK)] + [EOT]
+        del frame
+    else:
+        message = bytearray(payload) if case == "send bytearray" else payload
+    del payload
+
+    with open("/proc/self/clear_refs", "w") as clearRefs:
+        clearRefs.write("5")  # the peak resident set size starts again from the resident one
+    baseline = readStatus("VmRSS")
+    if case.startswith("receive"):
+        for chunk in chunks:
+            port._receive(chunk)
+    else:
+        port.write(message)
+        port._receive(ACK)  # the bid is accepted, the message goes out
+
+    results.put((readStatus("VmHWM") - baseline) * 1024.0 / size)
+
+
+def runMemoryBenchmark(size=MEMORY_SIZE):
+    '''
+    Memory taken on the way by a message of size bytes received or sent by a port, as the growth of the peak
+    resident set size in units of the message size: the number of copies of the message alive at once,
+    the buffers grown on the way included. Linux only. Returns [(case, copies)] for every one of MEMORY_CASES.
+    '''
+    results = []
+    for case in MEMORY_CASES:
+        queue = multiprocessing.Queue()
+        process = multiprocessing.Process(target=measureMemory, args=(case, size, queue))
+        process.start()
+        results.append((case, queue.get()))
+        process.join()
+
+    return results
+
+
+def runSubmitBenchmark(producers=BENCHMARK_PRODUCERS, count=BENCHMARK_COUNT, size=BENCHMARK_SIZE, batched=True, rate=None):
+    '''
+    producers threads hand count messages each over to a port running in the calling thread and the figures
+    come back as a dict. Latencies are from the hand-over to the message entering the outbound queue, in ms.
+    With batched set the threads use submit(), otherwise every message is marshalled with a wakeup of its own,
+    the way it had to be done before submit(). rate limits every thread to that many messages per second,
+    flat out the latencies are mostly the time the messages wait for the loop to catch up.
+    '''
+    scheduler = SchedScheduler()
+    port = DiscardingPort(scheduler)
+    port.enableMetrics()
+    payload = "U" * size
+    deliveries = [[] for _ in xrange(producers)]
+    latencies = []  # of the marshalled messages, appended in the port's thread only
+
+    def handOver(submitted):
+        delivery = port.write(payload)[0]
+        latencies.append(delivery.enqueued - submitted)
+
+    def produce(index):
+        started = time.time()
+        for number in xrange(count):
+            if rate:
+                delay = started + float(number) / rate - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+
+            if batched:
+                deliveries[index].extend(port.submit(payload))
+            else:
+                scheduler.callSoonThreadsafe(functools.partial(handOver, scheduler.now()))
+
+    threads = [threading.Thread(target=produce, args=(index,)) for index in xrange(producers)]
+    keepAlive = scheduler.callLater(3600 * 1000, lambda: None)  # run() returns as soon as nothing is scheduled
+    finished = [None]
+
+    def finish():
+        finished[0] = scheduler.now()
+        port.reset()  # no more bids for the messages nobody will ACK
+        keepAlive.cancel()
+
+    def coordinate():
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        scheduler.callSoonThreadsafe(finish)  # after the hand-overs queued before it
+
+    started = scheduler.now()
+    coordinator = threading.Thread(target=coordinate)
+    coordinator.start()
+    scheduler.run()
+    coordinator.join()
+    scheduler.close()
+
+    if batched:
+        latencies = [delivery.enqueued - delivery.submitted for items in deliveries for delivery in items]
+
+    latencies.sort()
+    total = producers * count
+    elapsed = (finished[0] - started) / 1000.0
+    return {"messages": total,
+            "queued": len(latencies),
+            "elapsed": elapsed,
+            "messagesPerSecond": total / elapsed if elapsed else None,
+            "latency50": percentile(latencies, 50),
+            "latency99": percentile(latencies, 99),
+            "wakeups": port.metrics.submitBatches if batched else total}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bisync benchmark over a simulated line.")
+    parser.add_argument("profiles", nargs="*", help="line profiles (%s), all of them by default" % ", ".join(sorted(PROFILES)))
+    parser.add_argument("-n", "--count", type=int, default=BENCHMARK_COUNT, help="messages per profile")
+    parser.add_argument("-s", "--size", type=int, default=BENCHMARK_SIZE, help="message size, bytes")
+    parser.add_argument("-w", "--window", type=int, default=1, help="messages queued at once")
+    parser.add_argument("--crc", action="store_true", help="CRC-16 instead of LRC")
+    parser.add_argument("--virtual", action="store_true", help="simulated time instead of real time")
+    parser.add_argument("--receive", action="store_true", help="CPU time per character received instead")
+    parser.add_argument("--decode", action="store_true", help="decoder CPU time per byte against the frame size instead")
+    parser.add_argument("--timers", action="store_true",
+                        help="timer subsystem CPU time of --lines lines of the first profile (modem by default) instead")
+    parser.add_argument("-l", "--lines", type=int, default=TIMER_LINES, help="lines for --timers")
+    parser.add_argument("--contention", action="store_true",
+                        help="goodput of two stations saturating the first profile (lan by default), by role, instead")
+    parser.add_argument("--memory", action="store_true",
+                        help="copies of a 16 MB message alive at once on the way in and out instead")
+    parser.add_argument("--checks", action="store_true", help="LRC and CRC-16 throughput on 1 KB to 1 MB payloads instead")
+    parser.add_argument("--capture", action="store_true",
+                        help="receive rate replaying a capture of the first profile's traffic instead")
+    parser.add_argument("-f", "--file", help="the capture file to replay for --capture")
+    parser.add_argument("--submit", action="store_true", help="hand-over from threads, submit() against a wakeup per message, instead")
+    parser.add_argument("-p", "--producers", type=int, default=BENCHMARK_PRODUCERS, help="threads for --submit")
+    parser.add_argument("-r", "--rate", type=float, help="messages per second per thread for --submit, flat out by default")
+    arguments = parser.parse_args()
+
+    if arguments.submit:
+        print "%-12s %9s %9s %10s %8s %8s %8s" % ("hand-over", "producers", "messages", "msg/s", "p50 us", "p99 us", "wakeups")
+        for batched in (False, True):
+            result = runSubmitBenchmark(arguments.producers, arguments.count, arguments.size, batched, arguments.rate)
+            print "%-12s %9d %9d %10s %8.1f %8.1f %8d" % (
+                "submit()" if batched else "per message", arguments.producers, result["messages"],
+                "%.0f" % result["messagesPerSecond"] if result["messagesPerSecond"] is not None else "-", result["latency50"] * 1000, result["latency99"] * 1000, result["wakeups"])
+        return
+
+    if arguments.decode:
+        print "%10s %10s %10s" % ("frame", "us/byte", "us/frame")
+        for size, perByte, perFrame in runDecodeBenchmark(blockCheck=CRC16() if arguments.crc else LRC()):
+            print "%10d %10.4f %10.1f" % (size, perByte, perFrame)
+        return
+
+    if arguments.contention:
+        profile = PROFILES[arguments.profiles[0]] if arguments.profiles else PROFILES["lan"]
+        print "%-18s %10s %10s %12s %10s %8s" % ("roles", "delivered", "elapsed s", "goodput B/s", "collisions", "errors")
+        for name, roles in (("none/none", (ROLE_NONE, ROLE_NONE)), ("primary/secondary", (ROLE_PRIMARY, ROLE_SECONDARY))):
+            result = runContentionBenchmark(profile, roles, arguments.count, arguments.size)
+            print "%-18s %10s %10.2f %12s %10d %8d" % (
+                name, "%d/%d" % (result["delivered"], result["messages"]), result["elapsed"],
+                "%.0f" % result["goodput"] if result["goodput"] is not None else "-", result["collisions"], result["errors"])
+        return
+
+    if arguments.memory:
+        print "%-34s %8s" % ("case", "copies")
+        for case, copies in runMemoryBenchmark():
+            print "%-34s %8.2f" % (case, copies)
+        return
+
+    if arguments.checks:
+        print "%-8s %10s %12s" % ("check", "payload", "MB/s")
+        for name, blockCheck in (("LRC", LRC()), ("CRC-16", CRC16())):
+            for size, rate in runBlockCheckBenchmark(blockCheck):
+                print "%-8s %10d %12s" % (name, size, "%.2f" % (rate / 1000000.0) if rate else "-")
+        return
+
+    if arguments.timers:
+        profile = PROFILES[arguments.profiles[0]] if arguments.profiles else PROFILES["modem"]
+        result = runTimerBenchmark(profile, arguments.lines, arguments.count, arguments.size)
+        print "%d lines, %d/%d messages delivered in %.1f s simulated, %.2f s CPU" % (
+            result["lines"], result["delivered"], result["messages"], result["elapsed"], result["cpu"])
+        print "%d timers armed, %d cancelled" % (result["armed"], result["cancelled"])
+        print "%-8s %10s %12s %12s %10s" % ("timers", "CPU ms", "us/timer", "loop timers", "wakeups")
+        for name in ("heap", "wheel"):
+            figures = result[name]
+            print "%-8s %10.1f %12.2f %12d %10d" % (name, figures["cpu"] * 1000, figures["cpu"] * 1000000 / result["armed"],
+                                                    figures["loopTimers"], figures["wakeups"])
+        print "loop timers: armed and cancelled on the event loop, the heap arms and cancels each protocol timer there"
+        print "wakeups: loop timers that fired, none for the heap when every protocol timer is cancelled before it is due"
+        return
+
+    if arguments.capture:
+        path = arguments.file
+        if not path:
+            handle, path = tempfile.mkstemp(suffix=".cap")
+            os.close(handle)
+            os.unlink(path)
+            profile = PROFILES[arguments.profiles[0]] if arguments.profiles else PROFILES["ideal"]
+            recordCapture(path, profile, arguments.count, arguments.size)
+
+        try:
+            total, chunked, perByte = runCaptureBenchmark(path)
+        finally:
+            if not arguments.file:
+                os.unlink(path)
+
+        print "%-12s %12s %12s" % ("dispatch", "bytes", "bytes/s")
+        print "%-12s %12d %12.0f" % ("per byte", total, perByte)
+        print "%-12s %12d %12.0f" % ("chunked", total, chunked)
+        return
+
+    if arguments.receive:
+        blockCheck = CRC16() if arguments.crc else LRC()
+        print "%.3f us/character" % runReceiveBenchmark(arguments.count, arguments.size, blockCheck=blockCheck)
+
+        # once more with every transition timed
+        machine = AbstractBisync.machine
+        machine.resetStats()
+        machine.profiling = True
+        try:
+            runReceiveBenchmark(arguments.count, arguments.size, blockCheck=blockCheck)
+        finally:
+            machine.profiling = False
+
+        print "%-24s %8s %8s" % ("transition", "count", "us")
+        for key, stats in sorted(machine.stats().items()):
+            if stats["count"]:
+                print "%-24s %8d %8.3f" % (key, stats["count"], stats["time"])
+        return
+
+    for name in arguments.profiles:
+        if name not in PROFILES:
+            parser.error("unknown profile %s" % name)
+
+    columns = ("profile", "delivered", "msg/s", "bytes/s", "p50 ms", "p99 ms", "cpu ms/msg", "naks", "collisions")
+    print "%-10s %9s %9s %10s %8s %8s %10s %5s %10s" % columns
+
+    for name in arguments.profiles or sorted(PROFILES):
+        blockCheck = CRC16() if arguments.crc else LRC()
+        result = runBenchmark(PROFILES[name], arguments.count, arguments.size, arguments.window, blockCheck,
+                              virtual=arguments.virtual)
+        print "%-10s %9s %9s %10s %8s %8s %10.3f %5d %10d" % (
+            name, "%d/%d" % (result["delivered"], result["messages"]),
+            "%.1f" % result["messagesPerSecond"] if result["messagesPerSecond"] is not None else "-",
+            "%.1f" % result["bytesPerSecond"] if result["bytesPerSecond"] is not None else "-",
+            "%.1f" % result["latency50"] if result["latency50"] is not None else "-",
+            "%.1f" % result["latency99"] if result["latency99"] is not None else "-",
+            result["cpuPerMessage"], result["naks"], result["collisions"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2015-2016 Alexey Naumov <rocketbuzzz@gmail.com>
+#
+# This file is part of rbisync.
+#
+# rbisync is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from timeit import default_timer
+
+
+class Transition(object):
+    '''
+    What an input symbol does in a state: the action called with (owner, data) and the state the owner is put in
+    before the action runs. A nextState of None leaves the state to the action, targets lists where it may go.
+    '''
+
+    __slots__ = ("state", "symbol", "action", "nextState", "targets", "count", "time")
+
+    def __init__(self, state, symbol, action, nextState=None, targets=()):
+        self.state = state
+        self.symbol = symbol
+        self.action = action
+        self.nextState = nextState
+        self.targets = tuple(targets) or ((nextState,) if nextState is not None else ())
+        self.count = 0  # firings measured while profiling
+        self.time = 0.0  # (s) spent in the action while profiling
+
+    @property
+    def name(self):
+        name = getattr(self.action, "__name__", repr(self.action))
+        return name.rsplit("__", 1)[-1].lstrip("_")  # private methods without the class prefix
+
+
+class StateMachine(object):
+    '''
+    Transition table indexed by [state][symbol]: firing a symbol costs two list lookups.
+    Symbols with no transition in a state are dropped (counted in droppedCount), their bytes are counted
+    in the owner's bytesDropped and taken off its bytesRouted.
+    The table is shared by all the owners, so are its counters.
+    The owner's state is its _machineState attribute, set right before the action runs; while its _observed
+    is True, its _stateChanging(state) is called first.
+    '''
+
+    def __init__(self, transitions, stateNames, symbolNames):
+        self.stateNames = stateNames  # state -> name
+        self.symbolNames = symbolNames  # symbol -> name
+        self.droppedCount = 0
+        self.profiling = False  # if set True, every firing is counted and timed, see stats()
+        self.__table = [[None] * len(symbolNames) for _ in xrange(len(stateNames))]
+
+        for transition in transitions:
+            if self.__table[transition.state][transition.symbol] is not None:
+                raise ValueError("Two transitions for %s in %s." % (symbolNames[transition.symbol],
+                                                                   stateNames[transition.state]))
+
+            self.__table[transition.state][transition.symbol] = transition
+
+    def fire(self, owner, state, symbol, data=None):
+        '''
+        Runs the transition for the symbol in the state, returns what the action returns.
+        '''
+        transition = self.__table[state][symbol]
+        if transition is None:
+            self.droppedCount += 1
+            if data is not None:
+                owner.bytesRouted -= len(data)
+                owner.bytesDropped += len(data)
+            return None
+
+        if self.profiling:
+            return self.__measure(transition, owner, data)
+
+        nextState = transition.nextState
+        if nextState is not None:
+            if owner._observed:
+                owner._stateChanging(nextState)
+            owner._machineState = nextState
+
+        return transition.action(owner, data)
+
+    def __measure(self, transition, owner, data):
+        started = default_timer()
+        nextState = transition.nextState
+        if nextState is not None:
+            if owner._observed:
+                owner._stateChanging(nextState)
+            owner._machineState = nextState
+
+        try:
+            return transition.action(owner, data)
+        finally:
+            transition.count += 1
+            transition.time += default_timer() - started
+
+    def lookup(self, state, symbol):
+        return self.__table[state][symbol]
+
+    def transitions(self):
+        return [transition for row in self.__table for transition in row if transition is not None]
+
+    def resetStats(self):
+        self.droppedCount = 0
+        for transition in self.transitions():
+            transition.count = 0
+            transition.time = 0.0
+
+    def stats(self):
+        '''
+        Firings and mean time per transition (in microseconds) measured while profiling, keyed by "STATE/SYMBOL".
+        '''
+        stats = {}
+        for transition in self.transitions():
+            key = "%s/%s" % (self.stateNames[transition.state], self.symbolNames[transition.symbol])
+            stats[key] = {"count": transition.count,
+                          "time": transition.time * 1000000.0 / transition.count if transition.count else 0.0}
+
+        return stats
+
+    def dot(self, name="bisync"):
+        '''
+        The table as a Graphviz digraph, edges are labelled "SYMBOL / action".
+        '''
+        lines = ["digraph %s {" % name]
+        for state in sorted(self.stateNames):
+            lines.append('    "%s";' % self.stateNames[state])
+
+        for transition in self.transitions():
+            label = "%s / %s" % (self.symbolNames[transition.symbol], transition.name)
+            for target in transition.targets or (transition.state,):
+                lines.append('    "%s" -> "%s" [label="%s"];' % (self.stateNames[transition.state],
+                                                                 self.stateNames[target], label))
+
+        lines.append("}")
+        return "\n".join(lines)
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2015-2016 Alexey Naumov <rocketbuzzz@gmail.com>
+#
+# This file is part of rbisync.
+#
+# rbisync is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from bisect import bisect_left
+from outbound import PRIORITY_LEVELS
+
+LATENCY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)  # (ms) upper bounds of the histogram buckets
+HANDOFF_BUCKETS = (0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10)  # (ms) Bisync.submit() is a lot faster than the line
+
+METRICS_PREFIX = "rbisync"
+
+
+class Histogram(object):
+    '''
+    Counts of the observed values per bucket, the last bucket takes everything above the largest bound.
+    '''
+
+    __slots__ = ("bounds", "counts", "count", "sum")
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def stats(self):
+        return {"buckets": dict(zip(self.bounds + ("+Inf",), self.counts)),
+                "count": self.count,
+                "sum": self.sum}
+
+
+class Metrics(object):
+    '''
+    Counters and histograms of one port. Created by AbstractBisync.enableMetrics(), the port only touches it
+    while it is enabled, a disabled port pays a single "is not None" test at every place it is updated.
+    Times are in milliseconds of the port's scheduler clock.
+    '''
+
+    def __init__(self, stateNames, state, now, levels=PRIORITY_LEVELS):
+        self.framesSent = 0
+        self.framesReceived = 0
+        self.bytesSent = 0
+        self.bytesReceived = 0
+        self.retries = 0  # ENQs repeated for want of an ACK
+        self.collisions = 0  # ENQ received in answer to our ENQ
+        self.naksSent = 0
+        self.naksReceived = 0
+        self.errors = {}  # key=error code, value=count
+        self.submitted = 0  # messages handed over by Bisync.submit()
+        self.submitBatches = 0  # scheduler wakeups that took them
+        self.coalesced = 0  # queued messages replaced by a newer one with the same key
+
+        self.bidLatency = Histogram()  # ENQ -> ACK
+        self.messageLatency = Histogram()  # message (block) -> ACK
+        self.submitLatency = Histogram(HANDOFF_BUCKETS)  # Bisync.submit() -> outbound queue
+        self.queueLatency = [Histogram() for _ in xrange(levels)]  # per priority: outbound queue -> line
+        self.dwell = dict((state, Histogram()) for state in stateNames)  # time spent in each state
+        self.__stateNames = stateNames
+        self.__state = state
+        self.__entered = now
+
+    def error(self, code):
+        self.errors[code] = self.errors.get(code, 0) + 1
+
+    def stateChanged(self, state, now):
+        self.dwell[self.__state].observe(now - self.__entered)
+        self.__state = state
+        self.__entered = now
+
+    def stats(self):
+        return {"framesSent": self.framesSent,
+                "framesReceived": self.framesReceived,
+                "bytesSent": self.bytesSent,
+                "bytesReceived": self.bytesReceived,
+                "retries": self.retries,
+                "collisions": self.collisions,
+                "naksSent": self.naksSent,
+                "naksReceived": self.naksReceived,
+                "errors": dict(self.errors),
+                "submitted": self.submitted,
+                "submitBatches": self.submitBatches,
+                "coalesced": self.coalesced,
+                "bidLatency": self.bidLatency.stats(),
+                "messageLatency": self.messageLatency.stats(),
+                "submitLatency": self.submitLatency.stats(),
+                "queueLatency": dict((priority, histogram.stats()) for priority, histogram in enumerate(self.queueLatency)),
+                "dwell": dict((self.__stateNames[state], histogram.stats()) for state, histogram in self.dwell.items())}
+
+    def prometheus(self, labels=None, prefix=METRICS_PREFIX):
+        '''
+        The metrics in the Prometheus text exposition format, labels (dict) are added to every sample.
+        '''
+        lines = []
+        counters = (("frames_sent_total", self.framesSent),
+                    ("frames_received_total", self.framesReceived),
+                    ("bytes_sent_total", self.bytesSent),
+                    ("bytes_received_total", self.bytesReceived),
+                    ("retries_total", self.retries),
+                    ("collisions_total", self.collisions),
+                    ("naks_sent_total", self.naksSent),
+                    ("naks_received_total", self.naksReceived),
+                    ("submitted_total", self.submitted),
+                    ("submit_batches_total", self.submitBatches),
+                    ("coalesced_total", self.coalesced))
+
+        for name, value in counters:
+            lines.append("# TYPE %s_%s counter" % (prefix, name))
+            lines.append("%s_%s%s %s" % (prefix, name, formatLabels(labels), value))
+
+        lines.append("# TYPE %s_errors_total counter" % prefix)
+        for code in sorted(self.errors):
+            lines.append("%s_errors_total%s %s" % (prefix, formatLabels(labels, code=code), self.errors[code]))
+
+        for name, histogram in (("bid_latency_ms", self.bidLatency), ("message_latency_ms", self.messageLatency),
+                                ("submit_latency_ms", self.submitLatency)):
+            lines.append("# TYPE %s_%s histogram" % (prefix, name))
+            lines.extend(formatHistogram("%s_%s" % (prefix, name), histogram, labels))
+
+        lines.append("# TYPE %s_queue_latency_ms histogram" % prefix)
+        for priority, histogram in enumerate(self.queueLatency):
+            extra = dict(labels or {}, priority=priority)
+            lines.extend(formatHistogram("%s_queue_latency_ms" % prefix, histogram, extra))
+
+        lines.append("# TYPE %s_state_dwell_ms histogram" % prefix)
+        for state in sorted(self.dwell):
+            extra = dict(labels or {}, state=self.__stateNames[state])
+            lines.extend(formatHistogram("%s_state_dwell_ms" % prefix, self.dwell[state], extra))
+
+        return "\n".join(lines) + "\n"
+
+
+def formatLabels(labels, **extra):
+    labels = dict(labels or {}, **extra)
+    if not labels:
+        return ""
+
+    return "{%s}" % ",".join('%s="%s"' % (name, str(labels[name]).replace("\\", "\\\\").replace('"', '\\"'))
+                             for name in sorted(labels))
+
+
+def formatHistogram(name, histogram, labels):
+    lines = []
+    cumulative = 0
+    for bound, count in zip(histogram.bounds + ("+Inf",), histogram.counts):
+        cumulative += count
+        lines.append("%s_bucket%s %s" % (name, formatLabels(labels, le=bound), cumulative))
+
+    lines.append("%s_sum%s %s" % (name, formatLabels(labels), histogram.sum))
+    lines.append("%s_count%s %s" % (name, formatLabels(labels), histogram.count))
+
+    return lines
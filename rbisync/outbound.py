@@ -0,0 +1,409 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2015-2016 Alexey Naumov <rocketbuzzz@gmail.com>
+#
+# This file is part of rbisync.
+#
+# rbisync is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+import threading
+from collections import deque
+
+# what OutboundQueue.push() does when the queue has reached its high-water mark
+OVERFLOW_BLOCK = 0  # Bisync.submit() waits in its caller's thread until the line takes a message, see reserve()
+OVERFLOW_DROP_OLDEST = 1
+OVERFLOW_DROP_NEWEST = 2
+OVERFLOW_RAISE = 3
+
+BLOCK_TIMEOUT = 5.0  # (s) OVERFLOW_BLOCK gives up and raises after waiting that long
+
+# priority levels of the outbound messages, a lower number goes first
+PRIORITY_URGENT = 0  # control commands: stop, reset...
+PRIORITY_NORMAL = 1
+PRIORITY_BULK = 2  # log uploads and the like
+PRIORITY_LEVELS = 3
+
+# how OutboundQueue picks the level of the next message
+SCHEDULING_STRICT = 0  # the most urgent level that has messages, lower levels wait for it to empty
+SCHEDULING_WEIGHTED = 1  # every level that has messages gets its weight's share of the bids, none starves
+
+WEIGHTS = (4, 2, 1)  # per level, for SCHEDULING_WEIGHTED
+
+DELIVERY_PENDING = 0
+DELIVERY_DELIVERED = 1
+DELIVERY_FAILED = 2
+
+
+class QueueOverflowError(RuntimeError):
+    pass
+
+
+class Delivery(object):
+    '''
+    Delivery status of one message returned by Bisync.write().
+    The callbacks added with addCallback() are called with the delivery once it is delivered or failed.
+    All the timestamps are in milliseconds of the port's scheduler clock.
+    '''
+
+    def __init__(self, message, enqueued):
+        self.message = message
+        self.status = DELIVERY_PENDING
+        self.error = None  # (code, description) if failed
+        self.enqueued = enqueued  # when the message entered the outbound queue
+        self.submitted = None  # when Bisync.submit() was called, None for Bisync.write()
+        self.priority = PRIORITY_NORMAL
+        self.key = None  # a newer message with the same key replaces this one while it is queued
+        self.bid = None  # the first ENQ sent for the message
+        self.acknowledged = None
+        self.__callbacks = []
+
+    def addCallback(self, callback):
+        if self.done:
+            callback(self)
+        else:
+            self.__callbacks.append(callback)
+
+    def resolve(self, acknowledged):
+        if self.done:
+            return
+
+        self.status = DELIVERY_DELIVERED
+        self.acknowledged = acknowledged
+        self.__finish()
+
+    def fail(self, error):
+        if self.done:
+            return
+
+        self.status = DELIVERY_FAILED
+        self.error = error
+        self.__finish()
+
+    def __finish(self):
+        callbacks, self.__callbacks = self.__callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+    @property
+    def done(self):
+        return self.status != DELIVERY_PENDING
+
+    @property
+    def latency(self):
+        '''
+        (ms) from write() to the ACK, None until delivered.
+        '''
+        if self.acknowledged is None:
+            return None
+
+        return self.acknowledged - self.enqueued
+
+
+class OutboundMessage(object):
+    __slots__ = ("frame", "enqueued", "delivery", "priority", "key")
+
+    def __init__(self, frame, enqueued, delivery, priority=PRIORITY_NORMAL, key=None):
+        self.frame = frame
+        self.enqueued = enqueued  # (ms) when the message was queued
+        self.delivery = delivery
+        self.priority = priority
+        self.key = key
+
+
+class LevelStats(object):
+    __slots__ = ("enqueued", "dequeued", "dropped", "coalesced", "totalWait", "maxWait")
+
+    def __init__(self):
+        self.enqueued = 0
+        self.dequeued = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.totalWait = 0  # (ms)
+        self.maxWait = 0  # (ms)
+
+
+class OutboundQueue(object):
+    '''
+    The messages waiting for the line: a FIFO per priority level, O(1) at both ends.
+    The level of the next message is picked by the scheduling policy when the line is bid for (see head()),
+    the highWaterMark bounds all the levels together, None means the queue is unbounded.
+    A message pushed with a key is indexed by it until it leaves the queue, see coalesce().
+    '''
+
+    def __init__(self, clock=None, highWaterMark=None, overflow=OVERFLOW_RAISE, levels=PRIORITY_LEVELS):
+        self.__levels = [deque() for _ in xrange(levels)]
+        self.__length = 0
+        self.__selected = None  # level of the message the current bid is for
+        self.__credits = [0] * levels  # of the smooth weighted round robin
+        self.__keys = {}  # key -> the queued OutboundMessage pushed with it
+        self.__reserved = 0  # room held for messages on their way to the queue, see reserve()
+        self.__clock = clock if clock is not None else (lambda: time.time() * 1000)
+        self.__space = threading.Condition(threading.Lock())
+        self.highWaterMark = highWaterMark
+        self.overflow = overflow
+        self.blockTimeout = BLOCK_TIMEOUT
+        self.scheduling = SCHEDULING_STRICT
+        self.weights = list(WEIGHTS[:levels]) + [1] * (levels - len(WEIGHTS))
+
+        self.enqueuedCount = 0
+        self.dequeuedCount = 0
+        self.droppedCount = 0
+        self.coalescedCount = 0
+        self.maxDepth = 0
+        self.totalWait = 0  # (ms) the sum of the time dequeued messages spent in the queue
+        self.maxWait = 0  # (ms)
+        self.__stats = [LevelStats() for _ in xrange(levels)]
+
+    def __len__(self):
+        return self.__length
+
+    def __full(self, count=1):
+        # no room for count more messages, the lock is held
+        return self.highWaterMark is not None and \
+            self.__length + self.__reserved + count > max(self.highWaterMark, count)
+
+    def __waitForRoom(self, count):
+        # the lock is held
+        deadline = time.time() + self.blockTimeout
+        while self.__full(count):
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise QueueOverflowError("Outbound queue is full (%s messages)." % self.__length)
+            self.__space.wait(remaining)
+
+    def hasRoom(self, count=1, key=None):
+        '''
+        There is room for count more messages, a message with a key already queued takes none (see coalesce()).
+        '''
+        with self.__space:
+            if key is not None and key in self.__keys:
+                return True
+
+            return self.highWaterMark is None or self.__length + self.__reserved + count <= self.highWaterMark
+
+    def reserve(self, count=1):
+        '''
+        Waits until there is room for count more messages and holds it for them, every one of them is then
+        push()ed with reserved=True or release()d. Raises QueueOverflowError after waiting blockTimeout.
+        Only the thread that pops the messages makes room, never call it in that thread.
+        '''
+        with self.__space:
+            self.__waitForRoom(count)
+            self.__reserved += count
+
+    def release(self, count=1):
+        '''
+        Gives back the room reserved for count messages that are not going to be pushed.
+        '''
+        with self.__space:
+            self.__reserved -= count
+            self.__space.notify_all()
+
+    def push(self, frame, delivery=None, priority=PRIORITY_NORMAL, overflow=None, key=None, reserved=False):
+        '''
+        Queues the frame. Returns the OutboundMessage dropped to make room for it (or the one just pushed),
+        None if nothing was dropped. overflow overrides the queue's policy for this push.
+        OVERFLOW_DROP_OLDEST drops the oldest message of the least urgent level.
+        reserved says the frame takes room held by reserve(), it is queued whatever the high-water mark.
+        '''
+        if not 0 <= priority < len(self.__levels):
+            raise ValueError("Priority %s out of 0..%s." % (priority, len(self.__levels) - 1))
+
+        item = OutboundMessage(frame, self.__clock(), delivery, priority, key)
+        overflow = overflow if overflow is not None else self.overflow
+        dropped = None
+        with self.__space:
+            if reserved:
+                self.__reserved -= 1
+            elif self.__full():
+                if overflow == OVERFLOW_BLOCK:
+                    self.__waitForRoom(1)
+
+                elif overflow == OVERFLOW_DROP_OLDEST:
+                    level = max(index for index, items in enumerate(self.__levels) if items)
+                    dropped = self.__remove(level)
+                    self.droppedCount += 1
+                    self.__stats[level].dropped += 1
+
+                elif overflow == OVERFLOW_DROP_NEWEST:
+                    self.droppedCount += 1
+                    self.__stats[priority].dropped += 1
+                    return item
+
+                else:
+                    raise QueueOverflowError("Outbound queue is full (%s messages)." % self.__length)
+
+            self.__levels[priority].append(item)
+            self.__length += 1
+            if key is not None:
+                self.__keys[key] = item
+            self.enqueuedCount += 1
+            self.__stats[priority].enqueued += 1
+            self.maxDepth = max(self.maxDepth, self.__length)
+
+        return dropped
+
+    def coalesce(self, key, frame, delivery=None, priority=None):
+        '''
+        Puts the frame in place of the queued message pushed with the key: it keeps that message's place
+        and enqueue time. A more urgent priority moves it to the end of that level (or to its head if the line
+        is being bid for it), a less urgent one or None leaves it where it is: being replaced never delays it.
+        The priority of the delivery is set to the one it is queued at. Returns the Delivery replaced,
+        None if no message with the key is queued (push() it then).
+        The message the line is being bid for may still be replaced, it is not sent yet.
+        '''
+        if priority is not None and not 0 <= priority < len(self.__levels):
+            raise ValueError("Priority %s out of 0..%s." % (priority, len(self.__levels) - 1))
+
+        with self.__space:
+            item = self.__keys.get(key)
+            if item is None:
+                return None
+
+            if priority is not None and priority < item.priority:
+                self.__move(item, priority)
+
+            replaced = item.delivery
+            item.frame = frame
+            item.delivery = delivery
+            self.coalescedCount += 1
+            self.__stats[item.priority].coalesced += 1
+
+        if delivery is not None:
+            delivery.priority = item.priority
+            if replaced is not None:
+                delivery.bid = replaced.bid  # the ENQ already sent is for the new one now
+
+        return replaced
+
+    def __move(self, item, priority):
+        # to a more urgent level as if it had been pushed there, the lock is held
+        old = self.__levels[item.priority]
+        if item.priority == self.__selected and old[0] is item:
+            old.popleft()
+            self.__levels[priority].appendleft(item)  # still the head the bid is for
+            self.__selected = priority
+        else:
+            old.remove(item)
+            self.__levels[priority].append(item)
+
+        self.__stats[item.priority].enqueued -= 1
+        self.__stats[priority].enqueued += 1
+        item.priority = priority
+
+    def __remove(self, level):
+        # the head of the level, the lock is held
+        if level == self.__selected:
+            self.__selected = None
+
+        self.__length -= 1
+        item = self.__levels[level].popleft()
+        if item.key is not None and self.__keys.get(item.key) is item:
+            del self.__keys[item.key]
+
+        return item
+
+    def __select(self):
+        if self.scheduling == SCHEDULING_WEIGHTED:
+            # smooth weighted round robin over the levels that have messages
+            credits = self.__credits
+            total = 0
+            best = None
+            for level, items in enumerate(self.__levels):
+                if items:
+                    credits[level] += self.weights[level]
+                    total += self.weights[level]
+                    if best is None or credits[level] > credits[best]:
+                        best = level
+
+            credits[best] -= total
+            return best
+
+        for level, items in enumerate(self.__levels):
+            if items:
+                return level
+
+    def head(self):
+        '''
+        The message the next bid is for. It is picked on the first call and stays the head until pop() or drop(),
+        even if a more urgent one comes in meanwhile.
+        '''
+        with self.__space:
+            return self.__levels[self.__head()][0]
+
+    def __head(self):
+        # the level of the head, the lock is held
+        if self.__selected is None:
+            if not self.__length:
+                raise IndexError("head of an empty queue")
+            self.__selected = self.__select()
+
+        return self.__selected
+
+    def pop(self):
+        with self.__space:
+            level = self.__head()
+            item = self.__remove(level)
+            self.__space.notify_all()  # reserve() callers wait for different counts, any of them may fit now
+
+        wait = self.__clock() - item.enqueued
+        self.dequeuedCount += 1
+        self.totalWait += wait
+        self.maxWait = max(self.maxWait, wait)
+
+        stats = self.__stats[level]
+        stats.dequeued += 1
+        stats.totalWait += wait
+        stats.maxWait = max(stats.maxWait, wait)
+
+        return item
+
+    def drop(self):
+        '''
+        Removes the head of the queue (see head()) without sending it.
+        '''
+        with self.__space:
+            level = self.__head()
+            item = self.__remove(level)
+            self.__space.notify_all()  # reserve() callers wait for different counts, any of them may fit now
+
+        self.droppedCount += 1
+        self.__stats[level].dropped += 1
+
+        return item
+
+    def depth(self, priority):
+        return len(self.__levels[priority])
+
+    def stats(self):
+        priorities = {}
+        for level, stats in enumerate(self.__stats):
+            priorities[level] = {"depth": len(self.__levels[level]),
+                                 "enqueued": stats.enqueued,
+                                 "dequeued": stats.dequeued,
+                                 "dropped": stats.dropped,
+                                 "coalesced": stats.coalesced,
+                                 "averageWait": float(stats.totalWait) / stats.dequeued if stats.dequeued else 0.0,
+                                 "maxWait": stats.maxWait}
+
+        return {"depth": self.__length,
+                "maxDepth": self.maxDepth,
+                "enqueued": self.enqueuedCount,
+                "dequeued": self.dequeuedCount,
+                "dropped": self.droppedCount,
+                "coalesced": self.coalescedCount,
+                "averageWait": float(self.totalWait) / self.dequeuedCount if self.dequeuedCount else 0.0,
+                "maxWait": self.maxWait,
+                "priorities": priorities}
@@ -0,0 +1,1099 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2015-2016 Alexey Naumov <rocketbuzzz@gmail.com>
+#
+# This file is part of rbisync.
+#
+# rbisync is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import sys
+import re
+import logging
+import threading
+from abc import abstractmethod
+from machine import StateMachine, Transition
+from decoder import FrameDecoder, FRAME_CAPACITY
+from outbound import OutboundQueue, Delivery, OVERFLOW_BLOCK, OVERFLOW_RAISE, QueueOverflowError
+from outbound import PRIORITY_URGENT, PRIORITY_NORMAL, PRIORITY_BULK, SCHEDULING_STRICT, SCHEDULING_WEIGHTED
+from transaction import Transaction, TransactionIndex
+from blockcheck import LRC
+from rtt import LinkTimeouts
+from metrics import Metrics
+from capture import Capture, CAPTURE_SIZE
+
+
+DEBUG = False  # if set True, debug messages are sent to stdout
+IGNORE_CHECKSUM_ERRORS = True
+
+ENQ = chr(05)
+ACK = chr(06)
+NAK = chr(21)
+STX = chr(02)
+ETX = chr(03)
+EOT = chr(04)
+ETB = chr(027)
+DLE = chr(020)
+ACK0 = DLE + "0"  # alternating acknowledgements of multi-block transmissions
+ACK1 = DLE + "1"
+
+CONTROL_PATTERN = re.compile("%s[01]|[%s]" % (re.escape(DLE), re.escape(ENQ + ACK + NAK + EOT)))
+
+# contention roles, which station wins when both bid for the line at once
+ROLE_NONE = 0  # both back off for a random time
+ROLE_PRIMARY = 1  # keeps bidding, the secondary station answers
+ROLE_SECONDARY = 2  # yields: acknowledges the primary's ENQ and bids again afterwards
+
+STATE_IDLE = 0
+STATE_ABOUT_TO_TX = 1
+STATE_TX_STARTED = 2
+STATE_TX_FINISHED = 3
+STATE_RX_STARTED = 4
+STATE_RX_FINISHED = 5
+
+# input symbols of the state machine
+SYMBOL_ENQ = 0
+SYMBOL_ACK = 1
+SYMBOL_ACK0 = 2
+SYMBOL_ACK1 = 3
+SYMBOL_NAK = 4
+SYMBOL_EOT = 5
+SYMBOL_TEXT = 6  # a run of frame data
+SYMBOL_TIMEOUT = 7  # what the state waits for did not come in time
+
+CONTROL_SYMBOL = {ENQ: SYMBOL_ENQ,
+                  ACK: SYMBOL_ACK,
+                  ACK0: SYMBOL_ACK0,
+                  ACK1: SYMBOL_ACK1,
+                  NAK: SYMBOL_NAK,
+                  EOT: SYMBOL_EOT}
+
+MAX_RETRY = 2  # ENQ repeated with exponential backoff, see LinkTimeouts.backoff()
+
+# initial timeouts, replaced by the measured ones as soon as the peer answers (see LinkTimeouts)
+TX_ENQ_WAIT_FOR_ACK = 250  # (мс) отправили ENQ, ждем ACK не дольше указанного интервала
+TX_MESSAGE_WAIT_FOR_ACK = 500  # (мс) отправили MESSAGE, ждем ACK не дольше указанного интервала
+TX_ACK_WAIT_FOR_MESSAGE = 100  # (мс) отправили ACK, ждем MESSAGE не дольше указанного интервала
+TX_ACK_WAIT_FOR_EOT = 125  # (мс) отправили ACK, ждем EOT не дольше указанного интервала
+TRANSACTION_TIMEOUT = 5000  # (ms) default time Bisync.transact() waits for the reply
+
+# errors
+CODE_DESCRIPTION = {
+   -1: "Unknown error",
+    1: "No ACK too long after several attempt(s) BEFORE sending message",
+    2: "Remote peer not responding",
+    3: "No ACK too long AFTER sending message",
+    4: "No message too long",
+    5: "No EOT too long",
+    6: "Remote peer not acknowledge transmission",
+    7: "Checksum error",
+    8: "Collision detected",
+    9: "Outbound queue overflow, message dropped",
+   10: "No reply too long",
+   11: "Superseded by a newer message with the same key",
+   12: "Port closed, message not sent"
+}
+
+# for debug purposes
+CODE_SYMBOL = {ord(EOT): "EOT",
+               ord(ENQ): "ENQ",
+               ord(ACK): "ACK",
+               ord(NAK): "NAK"}
+
+CODE_STATE = {STATE_IDLE: "IDLE",
+              STATE_ABOUT_TO_TX: "ABOUT_TO_TX",
+              STATE_TX_STARTED: "TX_STARTED",
+              STATE_TX_FINISHED: "TX_FINISHED",
+              STATE_RX_STARTED: "RX_STARTED",
+              STATE_RX_FINISHED: "RX_FINISHED"}
+
+CODE_INPUT = {SYMBOL_ENQ: "ENQ",
+              SYMBOL_ACK: "ACK",
+              SYMBOL_ACK0: "ACK0",
+              SYMBOL_ACK1: "ACK1",
+              SYMBOL_NAK: "NAK",
+              SYMBOL_EOT: "EOT",
+              SYMBOL_TEXT: "TEXT",
+              SYMBOL_TIMEOUT: "TIMEOUT"}
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+handler = logging.StreamHandler(sys.stdout)
+handler.setLevel(logging.INFO)
+
+formatter = logging.Formatter('%(asctime)s: %(lineno)4d %(module)s.%(funcName)-12s >>> %(message)s')
+handler.setFormatter(formatter)
+
+logger.addHandler(handler)
+
+if DEBUG:
+    logging.disable(logging.NOTSET)
+else:
+    logging.disable(logging.INFO)
+
+
+class AbstractBisync(object):
+    '''
+    Transport agnostic part of the binary synchronous communications protocol.
+    Subclasses feed received data to _receive() and implement _transmit().
+    The protocol is the transition table AbstractBisync.machine: every control character, run of frame data and
+    expired wait is one lookup by (state, symbol), see the table at the end of the class.
+    '''
+
+    baudRate = None  # the port's, used to scale the timeouts with the time frames spend on the line
+
+    def __init__(self, scheduler, blockCheck=None):
+        self.__scheduler = scheduler
+        self.__blockCheck = blockCheck if blockCheck is not None else LRC()
+        self._machineState = STATE_IDLE  # set by StateMachine.fire() and _enter(), read state
+        self.__on_read = None
+        self.__on_error = None
+        self.messages = OutboundQueue(clock=scheduler.now)  # see OutboundQueue.highWaterMark, .overflow and .scheduling
+        self.blockSize = None  # longer messages are sent as several STX...ETB blocks and the final STX...ETX block
+        self.conversational = False  # if set True, a received message may be answered with a reply instead of ACK
+        self.zeroCopy = False  # if set True, onRead gets a memoryview valid only during the call instead of a str
+        self.transparent = False  # if set True, messages are sent as transparent text and may hold any byte
+        self.__txBuffer = bytearray(FRAME_CAPACITY)  # frames are assembled here right before they are sent
+        self.__reply = None
+        self.correlationKey = None  # frame -> key, lets transact(key=...) find the waiting transaction in O(1)
+        self.role = ROLE_NONE
+        self.__rebidTimer = None
+        self.__transactions = TransactionIndex()
+        self.__rxTail = ""  # DLE of ACK0/ACK1 split between two reads
+        self.metrics = None  # see enableMetrics()
+        self.capture = None  # see startCapture()
+        self.bytesRouted = 0  # received bytes that reached a transition of the state machine
+        self.bytesDropped = 0  # received bytes no transition of the current state took (line noise, a stray ACK)
+        self._observed = DEBUG  # the state changes go through _stateChanging(), see __observe()
+        self.__submitted = []  # (message, delivery, reserved) handed over by other threads, see submit()
+        self.__submitLock = threading.Lock()
+        self.__drainPending = False  # the scheduler has been asked to drain __submitted
+
+        self.__timeouts = LinkTimeouts(lambda: self.baudRate, TX_ENQ_WAIT_FOR_ACK, TX_MESSAGE_WAIT_FOR_ACK,
+                                       TX_ACK_WAIT_FOR_MESSAGE, TX_ACK_WAIT_FOR_EOT)
+
+        # one timer per port: every state waits for one thing at most
+        self.__waitTimer = None
+        self.__waitTimeout = None
+        self.__waitStarted = None  # (ms)
+
+        self.__retryCount = 0  # ENQ repeated for the message at the head of the queue
+        self.__enqTimeout = TX_ENQ_WAIT_FOR_ACK
+
+        # the message being sent
+        self.__txPayload = None
+        self.__txBlocks = ()  # (start, end, terminator) of every block in the payload
+        self.__txDelivery = None
+        self.__txBlock = 0  # index of the block waiting for ACK
+        self.__txAck = ACK1  # multi-block transmissions are acknowledged by ACK1, ACK0, ACK1...
+        self.__txFrameLength = 0  # of the block waiting for ACK, characters on the line
+
+        # the message being received
+        self.__decoder = FrameDecoder(self.__blockCheck)
+        self.__decoder.onFrame = self.__onFrame
+        self.__rxBlocks = 0  # blocks of a multi-block transmission received so far, the decoder keeps them
+        self.__rxAck = ACK0
+
+    def __send(self, data, timeout):
+        self.__write(data)
+        self.__startWait(timeout)
+
+    def __startWait(self, timeout):
+        self.__stopWait()
+        self.__waitTimeout = timeout
+        self.__waitStarted = self.__scheduler.now()
+        self.__waitTimer = self.__scheduler.callLater(timeout, self.__onWaitExpired)
+
+    def __stopWait(self):
+        if self.__waitTimer is not None:
+            self.__waitTimer.cancel()
+            self.__waitTimer = None
+
+    def __onWaitExpired(self):
+        self.__waitTimer = None
+        self.machine.fire(self, self._machineState, SYMBOL_TIMEOUT)
+
+    def __bidNext(self):
+        if self.messages and self.__rebidTimer is None:  # backing off after a collision, __onRebid() bids
+            self.writeENQ()
+
+    def bid(self):
+        '''
+        Bids for the line if messages are queued and the port is idle and not backing off: for open() to send
+        what was written while the port was closed.
+        '''
+        if self.messages and self.state == STATE_IDLE and self.__rebidTimer is None:
+            self.writeENQ()
+
+    def writeENQ(self):
+        self._enter(STATE_ABOUT_TO_TX)
+        if DEBUG:
+                logger.info("ТX ENQ")
+
+        if not self.__retryCount:
+            self.__enqTimeout = self.__timeouts.enqWaitForAck()
+
+        try:
+            self.__send(ENQ, self.__enqTimeout)
+        except IOError:
+            # the port is closed: no bid, the messages wait for open() (see bid())
+            self.__retryCount = 0
+            self._enter(STATE_IDLE)
+            return
+
+        if self.messages:
+            delivery = self.messages.head().delivery
+            if delivery is not None and delivery.bid is None:
+                delivery.bid = self.__scheduler.now()
+
+    def rebid(self):
+        '''
+        Bids for the line again after a random delay, the peer doing the same will most likely pick another one.
+        Meanwhile nothing else bids: neither write(), submit() nor the end of the peer's transmission.
+        '''
+        if self.__rebidTimer is None:
+            self.__rebidTimer = self.__scheduler.callLater(self.__timeouts.contentionBackoff(), self.__onRebid)
+
+    def __onRebid(self):
+        self.__rebidTimer = None
+        self.bid()  # unless the peer has the line by now, the EOT bids then
+
+    def writeMessage(self):
+        if self.messages:
+            item = self.messages.pop()
+            payload, blocks = item.frame
+            if self.metrics is not None:
+                self.metrics.queueLatency[item.priority].observe(self.__scheduler.now() - item.enqueued)
+            if DEBUG:
+                logger.info("ТX {} BLOCKS={}".format(memoryview(payload).tobytes(), len(blocks)))
+
+            self.__startTransmission(payload, blocks, item.delivery)
+
+    def __startTransmission(self, payload, blocks, delivery=None):
+        self.__txPayload = payload
+        self.__txBlocks = blocks
+        self.__txDelivery = delivery
+        self.__txBlock = 0
+        self.__txAck = ACK1
+        self.writeBlock(payload, blocks[0])
+
+    def writeBlock(self, payload, block):
+        if self.metrics is not None:
+            self.metrics.framesSent += 1
+
+        frame = self.__frameBlock(payload, block)
+        self.__txFrameLength = len(frame)  # doubled DLEs included
+        self.__send(frame, self.__timeouts.messageWaitForAck(self.__txFrameLength))
+
+    def writeACK(self, ack=ACK):
+        if self.state == STATE_IDLE:
+            self._enter(STATE_RX_STARTED)
+            if DEBUG:
+                logger.info("ТX ACK")
+
+            self.__send(ACK, self.__timeouts.ackWaitForMessage())
+            return
+
+        if self.state == STATE_RX_FINISHED:
+            self._enter(STATE_IDLE)
+            if DEBUG:
+                logger.info("ТX {}".format(CODE_SYMBOL.get(ord(ack[0]), repr(ack)) if len(ack) == 1 else repr(ack)))
+
+            self.__send(ack, self.__timeouts.ackWaitForEot())
+            return
+
+    def writeReply(self, reply):
+        self._enter(STATE_TX_STARTED)
+        blocks = self.__blocks(len(reply), False)
+        if DEBUG:
+                logger.info("ТX reply {}".format(memoryview(reply).tobytes()))
+
+        self.__startTransmission(reply, blocks)
+
+    def writeEOT(self):
+        if DEBUG:
+                logger.info("ТX EOT")
+
+        self.__write(EOT)
+
+    def writeNAK(self):
+        if DEBUG:
+                logger.info("ТX NAK")
+
+        if self.metrics is not None:
+            self.metrics.naksSent += 1
+
+        self.__write(NAK)
+
+    def _receive(self, data):
+        # control characters are dispatched one by one, runs of frame data in between go as a single slice;
+        # while a frame is coming in everything goes to the decoder, transparent text may hold any character
+        if not isinstance(data, str):
+            data = memoryview(data).tobytes()  # a bytearray or a memoryview read, copied once: the dispatch takes str
+
+        self.bytesRouted += len(data)  # less what the machine drops, see StateMachine.fire()
+        if self.metrics is not None:
+            self.metrics.bytesReceived += len(data)
+
+        if self.capture is not None:
+            self.capture.received(data)
+
+        if self.__rxTail:
+            data = self.__rxTail + data
+            self.__rxTail = ""
+
+        fire = self.machine.fire
+        position = 0
+        end = len(data)
+        while position < end:
+            state = self._machineState
+            if state == STATE_RX_STARTED:
+                consumed = fire(self, state, SYMBOL_TEXT, data[position:] if position else data)
+                position += consumed or end - position  # the decoder stops right after a frame
+                continue
+
+            match = CONTROL_PATTERN.search(data, position)
+            if match is None:
+                if data[-1] == DLE and state == STATE_TX_STARTED:
+                    if position < end - 1:
+                        fire(self, state, SYMBOL_TEXT, data[position:end - 1])
+                        position = end - 1
+                        continue  # unless the data started a frame, the DLE is kept
+
+                    self.__rxTail = DLE  # the rest of ACK0/ACK1 comes with the next read
+                    return
+
+                fire(self, state, SYMBOL_TEXT, data[position:end])
+                return
+
+            index = match.start()
+            if index > position:
+                fire(self, state, SYMBOL_TEXT, data[position:index])
+                position = index
+                continue  # the data may have started a frame (a conversational reply)
+
+            position = match.end()
+            self.__readControl(match.group())
+
+    def __readControl(self, data):
+        symbol = CONTROL_SYMBOL[data]
+        if DEBUG:
+            logger.info("RX {}".format(CODE_INPUT[symbol]))
+
+        if symbol == SYMBOL_NAK and self.metrics is not None:
+            self.metrics.naksReceived += 1
+
+        self.machine.fire(self, self._machineState, symbol, data)
+
+    def reset(self):
+        '''
+        Back to idle, the message being sent and the queued ones fail with the "Port closed" error.
+        '''
+        self.__stopWait()
+        if self.__rebidTimer is not None:
+            self.__rebidTimer.cancel()
+            self.__rebidTimer = None
+        self.__retryCount = 0
+        self.__rxTail = ""
+        self.__resetRx()
+        self._enter(STATE_IDLE)
+
+        deliveries = [self.messages.drop().delivery for _ in xrange(len(self.messages))]
+        if self.__txDelivery is not None:
+            deliveries.insert(0, self.__txDelivery)
+            self.__txDelivery = None
+
+        # "Port closed, message not sent"
+        errorCode = 12
+        error = (errorCode, self.errorString(errorCode))
+        for delivery in deliveries:  # last, the callbacks may write again
+            if delivery is not None:
+                delivery.fail(error)
+
+    # actions of the transition table, called with the received symbol's data (None for SYMBOL_TIMEOUT)
+
+    def __onBid(self, data):
+        self.writeACK()
+
+    def __onEndOfTransmission(self, data):
+        if self.__waitTimer is None:
+            return  # nobody waits for it
+
+        self.__stopWait()
+        self.__bidNext()
+
+    def __onEotMissing(self, data):
+        # "No EOT too long"
+        errorCode = 5
+        errorDescription = self.errorString(errorCode)
+        error = (errorCode, errorDescription)
+        self._onError(error)
+
+        self.__bidNext()
+
+    def __onBidAccepted(self, data):
+        self.__stopWait()
+        if not self.__retryCount:  # the ACK to a repeated ENQ can not be told from the ACK to the first one
+            rtt = self.__scheduler.now() - self.__waitStarted
+            self.__timeouts.sampleBid(rtt)
+            if self.metrics is not None:
+                self.metrics.bidLatency.observe(rtt)
+        self.__retryCount = 0
+
+        self.writeMessage()
+
+    def __onCollision(self, data):
+        if self.metrics is not None:
+            self.metrics.collisions += 1
+
+        if self.role == ROLE_PRIMARY:
+            return  # the secondary station yields, keep waiting for its ACK
+
+        self.__stopWait()
+        self.__retryCount = 0
+        self._enter(STATE_IDLE)
+
+        if self.role == ROLE_SECONDARY:
+            self.writeACK()  # our message waits until the primary's transmission is over
+            return
+
+        # "Collision detected"
+        errorCode = 8
+        errorDescription = self.errorString(errorCode)
+        error = (errorCode, errorDescription)
+        self._onError(error)
+
+        self.rebid()
+
+    def __onBidRefused(self, data):
+        self.__stopWait()
+        self.__retryCount = 0
+        self.rebid()  # the peer is not ready to receive, the message stays queued
+
+    def __onBidTimeout(self, data):
+        self.__retryCount += 1
+
+        if self.__retryCount <= MAX_RETRY:
+            self.__enqTimeout = self.__timeouts.backoff(self.__retryCount)
+            if self.metrics is not None:
+                self.metrics.retries += 1
+
+            # "No ACK too long after several attempt(s) before sending message"
+            errorCode = 1
+            errorDescription = self.errorString(errorCode)
+            error = (errorCode, errorDescription)
+            self._onError(error)
+
+            self.writeENQ()
+
+        else:
+            self.__retryCount = 0
+
+            # "Remote peer not responding"
+            errorCode = 2
+            errorDescription = self.errorString(errorCode)
+            error = (errorCode, errorDescription)
+            self._onError(error)
+
+            item = self.messages.drop() if self.messages else None
+
+            self.__bidNext()
+
+            # after the bid, so that a callback writing the next message does not bid once more
+            if item is not None and item.delivery is not None:
+                item.delivery.fail(error)
+
+    def __onBlockAcknowledged(self, data):
+        self.__stopWait()
+
+        if data != ACK and len(self.__txBlocks) > 1 and data != self.__txAck:
+            self._enter(STATE_IDLE)
+
+            if DEBUG:
+                logger.info("RX {}, expected {}".format(repr(data), repr(self.__txAck)))
+
+            # "Remote peer not acknowledge transmission"
+            errorCode = 6
+            errorDescription = self.errorString(errorCode)
+            error = (errorCode, errorDescription)
+            self._onError(error)
+
+            self.writeEOT()
+            self.__bidNext()
+            self.__failTransmission(error)
+            return
+
+        rtt = self.__scheduler.now() - self.__waitStarted
+        self.__timeouts.sampleMessage(rtt, self.__txFrameLength)
+        if self.metrics is not None:
+            self.metrics.messageLatency.observe(rtt)
+
+        self.__txBlock += 1
+        if self.__txBlock < len(self.__txBlocks):
+            if DEBUG:
+                logger.info("TX block {}".format(self.__txBlock + 1))
+
+            self.__txAck = ACK0 if self.__txAck == ACK1 else ACK1
+            self.writeBlock(self.__txPayload, self.__txBlocks[self.__txBlock])
+            return
+
+        self._enter(STATE_TX_FINISHED)
+        self.__resolveTransmission()
+
+        self._enter(STATE_IDLE)
+        self.writeEOT()
+        self.__bidNext()
+
+    def __onMessageRefused(self, data):
+        self.__stopWait()
+        self.__bidNext()
+
+        # "Remote peer not acknowledge transmission"
+        errorCode = 6
+        errorDescription = self.errorString(errorCode)
+        error = (errorCode, errorDescription)
+        self._onError(error)
+
+        self.__failTransmission(error)
+
+    def __onReply(self, data):
+        if STX not in data or not self.conversational or self.__txBlock != len(self.__txBlocks) - 1:
+            return None
+
+        # a conversational reply acknowledges the message and turns the line around
+        self.__stopWait()
+
+        if DEBUG:
+            logger.info("RX conversational reply")
+
+        self.__resolveTransmission()
+        self._enter(STATE_RX_STARTED)
+        self.__startWait(self.__timeouts.ackWaitForMessage())
+
+        return self.__onFrameData(data)
+
+    def __onMessageTimeout(self, data):
+        # "No ACK too long AFTER sending message"
+        errorCode = 3
+        errorDescription = self.errorString(errorCode)
+        error = (errorCode, errorDescription)
+        self._onError(error)
+
+        # если есть сообщения в очереди, пробеум отправить следующее сообщение
+        # (the message sent has already left the queue in writeMessage)
+        self.__bidNext()
+
+        self.__failTransmission(error)
+
+    def __onFrameData(self, data):
+        consumed = self.__decoder.feed(data)
+        if self.__decoder.pending:
+            self.__startWait(self.__waitTimeout)  # restart the timer, long frames take their time on slow lines
+
+        return consumed
+
+    def __onMessageMissing(self, data):
+        self.__resetRx()
+
+        # "No message too long"
+        errorCode = 4
+        errorDescription = self.errorString(errorCode)
+        error = (errorCode, errorDescription)
+        self._onError(error)
+
+        self.__bidNext()
+
+    def __onFrame(self, message, checksum_local, checksum_remote, final):
+        self.__stopWait()
+        if self.metrics is not None:
+            self.metrics.framesReceived += 1
+
+        checksum_ok = True if checksum_local == checksum_remote else False
+
+        if DEBUG:
+            logger.info("RX {} CHECKSUM={}({})".format(message.tobytes(), checksum_local, "ok" if checksum_ok else "not ok"))
+
+        if IGNORE_CHECKSUM_ERRORS:
+            checksum_ok = True
+
+        if checksum_ok:
+            ack = ACK
+            if self.__rxBlocks or not final:
+                self.__rxAck = ACK0 if self.__rxAck == ACK1 else ACK1
+                ack = self.__rxAck
+                self.__rxBlocks += 1
+
+            if not final:
+                if DEBUG:
+                    logger.info("ТX {}".format(repr(ack)))
+
+                self.__send(ack, self.__timeouts.ackWaitForMessage())  # wait for the next block
+                return
+
+            if self.__rxBlocks:
+                self.__resetRx()  # message spans all the blocks
+
+            if not self.zeroCopy:
+                message = message.tobytes()
+
+            reply = self._onReadyRead(message)
+            self._enter(STATE_RX_FINISHED)
+
+            if reply is not None and self.conversational:
+                self.writeReply(reply)  # in place of the ACK
+                return
+
+            self.writeACK(ack)
+        else:
+            self.__resetRx()
+
+            errorCode = 7
+            errorDescription = "Checksum error in %s. Expected: %s, received: %s" % (message.tobytes(), checksum_local, checksum_remote)
+            error = (errorCode, errorDescription)
+            self._onError(error)
+
+            self._enter(STATE_RX_FINISHED)
+            self._enter(STATE_IDLE)
+            self.writeNAK()
+
+    def __resetRx(self):
+        self.__decoder.reset()
+        self.__rxBlocks = 0
+        self.__rxAck = ACK0
+
+    def __resolveTransmission(self):
+        if self.__txDelivery is not None:
+            self.__txDelivery.resolve(self.__scheduler.now())
+
+    def __failTransmission(self, error):
+        if self.__txDelivery is not None:
+            self.__txDelivery.fail(error)
+
+    def __write(self, message):
+        self._transmit(message)  # first: what a closed port refuses is not counted
+
+        if self.metrics is not None:
+            self.metrics.bytesSent += len(message)
+
+        if self.capture is not None:
+            self.capture.transmitted(message)
+
+    @abstractmethod
+    def _transmit(self, data):
+        pass
+
+    def _onReadyRead(self, message):
+        self.__reply = None
+        if self.__transactions:
+            frame = message.tobytes() if isinstance(message, memoryview) else message  # the reply outlives the buffer
+            transaction = self.__transactions.match(frame, self.correlationKey)
+            if transaction is not None:  # replies to transactions do not reach onRead
+                self.__finishTransaction(transaction)
+                transaction.reply = frame
+                transaction.resolve(self.__scheduler.now())
+                return None
+
+        if self.__on_read:
+            reply = self.__on_read(message)
+            if reply is not None:
+                return reply
+
+        reply, self.__reply = self.__reply, None
+        return reply
+
+    def reply(self, message):
+        '''
+        Queues the reply to the message being read, call it from the onRead callback.
+        Returning the reply from the callback does the same. Only used in conversational mode.
+        '''
+        self.__reply = message
+
+    def _onError(self, error):
+        if self.metrics is not None:
+            self.metrics.error(error[0])
+
+        if self.__on_error:
+            self.__on_error(error)
+
+    def enableMetrics(self):
+        '''
+        Starts counting, returns the Metrics object (also available as Bisync.metrics).
+        '''
+        if self.metrics is None:
+            self.metrics = Metrics(CODE_STATE, self._machineState, self.__scheduler.now())
+            self.__observe()
+
+        return self.metrics
+
+    def disableMetrics(self):
+        self.metrics = None
+        self.__observe()
+
+    def startCapture(self, path, size=CAPTURE_SIZE):
+        '''
+        Records the traffic and the state changes of the port to the ring file at path, see Capture and Replayer.
+        '''
+        self.stopCapture()
+        self.capture = Capture(path, size, self.__scheduler.now)
+        self.__observe()
+
+        return self.capture
+
+    def stopCapture(self):
+        if self.capture is not None:
+            self.capture.close()
+            self.capture = None
+            self.__observe()
+
+    def errorString(self, errorCode):
+        description = CODE_DESCRIPTION.get(errorCode, None)
+        if None:
+            description = CODE_DESCRIPTION[-1]
+
+        return description
+
+    def write(self, message, priority=PRIORITY_NORMAL, key=None):
+        '''
+        Queues the message(s), returns the list of their Delivery objects.
+        A bytearray or a memoryview is sent as a single message and is not copied, leave it alone until it is delivered.
+        In transparent mode a string is a single message too.
+        priority is PRIORITY_URGENT, PRIORITY_NORMAL or PRIORITY_BULK, see OutboundQueue.scheduling for how
+        the levels share the line. A message being sent is never interrupted by a more urgent one.
+        With a key (any hashable) the message replaces the queued one written with the same key, which fails
+        with the "Superseded" error, and takes its place in the queue: only the latest value is sent.
+        A more urgent priority moves it up to that level, a less urgent one keeps the level it was queued at,
+        Delivery.priority says which.
+        Only call it in the scheduler's thread, other threads have submit(). That thread is the one emptying
+        the queue, so it must not wait for room: with OVERFLOW_BLOCK it raises ValueError.
+        With OVERFLOW_RAISE, QueueOverflowError is raised before anything is queued unless all the messages fit.
+        '''
+        if self.messages.overflow == OVERFLOW_BLOCK:
+            raise ValueError("write() can not block the scheduler's thread, use submit() with OVERFLOW_BLOCK")
+
+        self.__checkPriority(priority)
+        messages = self.__split(message)
+        self.__checkKey(messages, key)
+
+        deliveries = []
+        if not messages:
+            return deliveries
+
+        if self.messages.overflow == OVERFLOW_RAISE and not self.messages.hasRoom(len(messages), key):
+            raise QueueOverflowError("Outbound queue is full (%s messages)." % len(self.messages))
+
+        for message in messages:
+            delivery = Delivery(message, self.__scheduler.now())
+            delivery.priority = priority
+            delivery.key = key
+            self.__enqueue(message, delivery)
+            deliveries.append(delivery)
+
+        self.bid()
+
+        return deliveries
+
+    def submit(self, message, priority=PRIORITY_NORMAL, key=None):
+        '''
+        Thread-safe write(): the message(s) are handed over to the scheduler's thread, which queues everything
+        submitted since its last turn as one batch, woken up once per batch. Returns the list of Delivery objects,
+        their callbacks are called in the scheduler's thread. A message the outbound queue has no room for
+        fails with the "Outbound queue overflow" error instead of raising. With OVERFLOW_BLOCK the caller
+        waits for room instead and gets QueueOverflowError if there is none within OutboundQueue.blockTimeout;
+        only the scheduler's thread makes room, so never call it in that thread then.
+        '''
+        self.__checkPriority(priority)
+        messages = self.__split(message)
+        self.__checkKey(messages, key)
+
+        reserved = self.messages.overflow == OVERFLOW_BLOCK and bool(messages)
+        if reserved:
+            self.messages.reserve(len(messages))  # may raise QueueOverflowError
+
+        now = self.__scheduler.now()
+
+        deliveries = []
+        for message in messages:
+            delivery = Delivery(message, None)
+            delivery.submitted = now
+            delivery.priority = priority
+            delivery.key = key
+            deliveries.append(delivery)
+
+        if not deliveries:
+            return deliveries
+
+        with self.__submitLock:
+            self.__submitted.extend((message, delivery, reserved) for message, delivery in zip(messages, deliveries))
+            if self.__drainPending:
+                return deliveries  # the batch is not taken yet, it takes these too
+            self.__drainPending = True
+
+        self.__scheduler.callSoonThreadsafe(self.__drainSubmitted)
+        return deliveries
+
+    def __drainSubmitted(self):
+        with self.__submitLock:
+            batch, self.__submitted = self.__submitted, []
+            self.__drainPending = False
+
+        now = self.__scheduler.now()
+        overflow = OVERFLOW_RAISE if self.messages.overflow == OVERFLOW_BLOCK else None  # never block the loop
+        for message, delivery, reserved in batch:
+            delivery.enqueued = now
+            try:
+                self.__enqueue(message, delivery, overflow, reserved)
+            except QueueOverflowError:
+                # "Outbound queue overflow, message dropped"
+                errorCode = 9
+                error = (errorCode, self.errorString(errorCode))
+                self._onError(error)
+                delivery.fail(error)
+
+        if self.metrics is not None:
+            self.metrics.submitBatches += 1
+            self.metrics.submitted += len(batch)
+            for _, delivery, _ in batch:
+                self.metrics.submitLatency.observe(now - delivery.submitted)
+
+        self.bid()
+
+    def __checkPriority(self, priority):
+        if priority not in (PRIORITY_URGENT, PRIORITY_NORMAL, PRIORITY_BULK):
+            raise ValueError("priority must be PRIORITY_URGENT, PRIORITY_NORMAL or PRIORITY_BULK not {}".format(priority))
+
+    def __checkKey(self, messages, key):
+        if key is not None and len(messages) > 1:
+            raise ValueError("a key is for a single message not {}".format(len(messages)))
+
+    def __split(self, message):
+        if isinstance(message, str) and self.transparent:
+            return [message] if message else []
+
+        if isinstance(message, str):
+            return str(message).split()  # in case we're trying to send something like "msg1 msg2     msg3"
+
+        if isinstance(message, (bytearray, memoryview)):
+            return [message] if len(message) else []
+
+        if isinstance(message, list):
+            return list(message)
+
+        raise TypeError("argument must be a string, a bytearray, a memoryview or a list of them not {}".format(type(message).__name__))
+
+    def __enqueue(self, message, delivery, overflow=None, reserved=False):
+        blocks = self.__blocks(len(message))
+        if delivery.key is not None:
+            superseded = self.messages.coalesce(delivery.key, (message, blocks), delivery, delivery.priority)
+            if superseded is not None:
+                if reserved:
+                    self.messages.release()  # took no room
+
+                if self.metrics is not None:
+                    self.metrics.coalesced += 1
+
+                # "Superseded by a newer message with the same key"
+                errorCode = 11
+                superseded.fail((errorCode, self.errorString(errorCode)))
+                return
+
+        dropped = self.messages.push((message, blocks), delivery, delivery.priority, overflow, delivery.key,
+                                     reserved)  # may raise QueueOverflowError
+        if dropped is not None:
+            # "Outbound queue overflow, message dropped"
+            errorCode = 9
+            errorDescription = self.errorString(errorCode)
+            error = (errorCode, errorDescription)
+            self._onError(error)
+            dropped.delivery.fail(error)
+
+    def transact(self, request, match=None, key=None, timeout=TRANSACTION_TIMEOUT, priority=PRIORITY_NORMAL):
+        '''
+        Sends the request and waits for the frame replying to it, returns a Transaction.
+        The reply is the next frame received that
+          - has the correlation key (see Bisync.correlationKey) if key is given, and
+          - starts with match if match is a string, or satisfies match if match is a callable.
+        With neither it is the next frame received.
+        '''
+        if isinstance(match, str):
+            prefix = match
+            match = lambda frame: frame.startswith(prefix)
+
+        if key is not None and self.correlationKey is None:
+            raise ValueError("transact(key=...) needs Bisync.correlationKey")
+
+        transaction = Transaction(request, self.__scheduler.now(), key, match)
+        self.__transactions.add(transaction)
+        transaction.timer = self.__scheduler.callLater(timeout, lambda: self.__expireTransaction(transaction))
+
+        try:
+            transaction.delivery = self.write([request], priority)[0]
+        except Exception:
+            self.__finishTransaction(transaction)
+            raise
+
+        transaction.delivery.addCallback(lambda delivery: self.__onTransactionDelivery(transaction))
+
+        return transaction
+
+    def __onTransactionDelivery(self, transaction):
+        transaction.bid = transaction.delivery.bid
+        if transaction.delivery.error is not None:
+            self.__finishTransaction(transaction)
+            transaction.fail(transaction.delivery.error)
+
+    def __expireTransaction(self, transaction):
+        transaction.timer = None
+        self.__finishTransaction(transaction)
+
+        # "No reply too long"
+        errorCode = 10
+        transaction.fail((errorCode, self.errorString(errorCode)))
+
+    def __finishTransaction(self, transaction):
+        self.__transactions.remove(transaction)
+        if transaction.timer is not None:
+            transaction.timer.cancel()
+            transaction.timer = None
+
+    def __blocks(self, length, split=True):
+        # only the block boundaries are kept in the queue, the frames are assembled by __frameBlock()
+        size = (self.blockSize if split else None) or length
+        blocks = []
+        for start in xrange(0, length, size):
+            end = min(start + size, length)
+            blocks.append((start, end, ETX if end == length else ETB))
+
+        return tuple(blocks)
+
+    def __frameBlock(self, payload, block):
+        '''
+        Assembles STX + text + terminator + BCC in the transmit buffer, returns a memoryview of it.
+        The view is only valid until the next frame is assembled.
+        '''
+        start, end, terminator = block
+        text = memoryview(payload)[start:end]
+        checksum = self.__blockCheck.encode(self.__blockCheck.update(self.__blockCheck.compute(text), terminator))
+
+        header, trailer = STX, terminator
+        if self.transparent:
+            # DLE STX text DLE ETX, every DLE of the text doubled; the check covers the text as it is
+            text = text.tobytes().replace(DLE, DLE + DLE)
+            header, trailer = DLE + STX, DLE + terminator
+
+        size = len(text)
+        textStart = len(header)
+        textEnd = textStart + size
+        length = textEnd + len(trailer) + len(checksum)
+        if length > len(self.__txBuffer):
+            self.__txBuffer = bytearray(max(length, 2 * len(self.__txBuffer)))  # views of the old one stay valid
+
+        buffer = memoryview(self.__txBuffer)  # the text is not copied to a temporary bytearray on the way, see FrameDecoder
+        buffer[0:textStart] = header
+        buffer[textStart:textEnd] = text
+        buffer[textEnd:textEnd + len(trailer)] = trailer
+        buffer[textEnd + len(trailer):length] = checksum
+
+        return buffer[:length]
+
+    @property
+    def onRead(self):
+        return self.__on_read
+
+    @onRead.setter
+    def onRead(self, callback):
+        self.__on_read = callback
+
+    @property
+    def onError(self):
+        return self.__on_error
+
+    @onError.setter
+    def onError(self, callback):
+        self.__on_error = callback
+
+    @property
+    def scheduler(self):
+        return self.__scheduler
+
+    @property
+    def blockCheck(self):
+        return self.__blockCheck
+
+    @property
+    def timeouts(self):
+        '''
+        The current round trip and timeout estimates, see LinkTimeouts.estimates().
+        '''
+        return self.__timeouts
+
+    @property
+    def state(self):
+        return self._machineState
+
+    def _enter(self, state):
+        '''
+        Puts the protocol in the state. The transitions of the state machine do it themselves, see StateMachine.fire().
+        '''
+        if self._observed:
+            self._stateChanging(state)
+
+        self._machineState = state
+
+    def _stateChanging(self, state):
+        # called right before the state changes, only while something watches it (see _observed)
+        if DEBUG:
+                logger.info("FROM {} -> TO {}".format(AbstractBisync.verboseState(self._machineState), AbstractBisync.verboseState(state)))
+
+        if self.metrics is not None:
+            self.metrics.stateChanged(state, self.__scheduler.now())
+
+        if self.capture is not None:
+            self.capture.stateChanged(state)
+
+    def __observe(self):
+        self._observed = DEBUG or self.metrics is not None or self.capture is not None
+
+    @staticmethod
+    def verboseState(state):
+        if state == STATE_IDLE:        return "IDLE"
+        if state == STATE_ABOUT_TO_TX: return "ABOUT_TO_TX"
+        if state == STATE_TX_STARTED:  return "TX_STARTED"
+        if state == STATE_TX_FINISHED: return "TX_FINISHED"
+        if state == STATE_RX_STARTED:  return "RX_STARTED"
+        if state == STATE_RX_FINISHED: return "RX_FINISHED"
+
+    # the protocol: (state, symbol) -> action and the state set before it runs (None: the action decides)
+    machine = StateMachine([
+        Transition(STATE_IDLE, SYMBOL_ENQ, __onBid, targets=(STATE_RX_STARTED,)),
+        Transition(STATE_IDLE, SYMBOL_EOT, __onEndOfTransmission, targets=(STATE_IDLE, STATE_ABOUT_TO_TX)),
+        Transition(STATE_IDLE, SYMBOL_TIMEOUT, __onEotMissing, STATE_IDLE, (STATE_IDLE, STATE_ABOUT_TO_TX)),
+
+        Transition(STATE_ABOUT_TO_TX, SYMBOL_ACK, __onBidAccepted, STATE_TX_STARTED),
+        Transition(STATE_ABOUT_TO_TX, SYMBOL_ENQ, __onCollision,
+                   targets=(STATE_ABOUT_TO_TX, STATE_IDLE, STATE_RX_STARTED)),
+        Transition(STATE_ABOUT_TO_TX, SYMBOL_NAK, __onBidRefused, STATE_IDLE),
+        Transition(STATE_ABOUT_TO_TX, SYMBOL_TIMEOUT, __onBidTimeout, STATE_IDLE, (STATE_ABOUT_TO_TX, STATE_IDLE)),
+
+        Transition(STATE_TX_STARTED, SYMBOL_ACK, __onBlockAcknowledged,
+                   targets=(STATE_TX_STARTED, STATE_TX_FINISHED, STATE_IDLE)),
+        Transition(STATE_TX_STARTED, SYMBOL_ACK0, __onBlockAcknowledged, targets=(STATE_TX_STARTED, STATE_IDLE)),
+        Transition(STATE_TX_STARTED, SYMBOL_ACK1, __onBlockAcknowledged, targets=(STATE_TX_STARTED, STATE_IDLE)),
+        Transition(STATE_TX_STARTED, SYMBOL_NAK, __onMessageRefused, STATE_IDLE, (STATE_IDLE, STATE_ABOUT_TO_TX)),
+        Transition(STATE_TX_STARTED, SYMBOL_TEXT, __onReply, targets=(STATE_RX_STARTED,)),
+        Transition(STATE_TX_STARTED, SYMBOL_TIMEOUT, __onMessageTimeout, STATE_IDLE, (STATE_IDLE, STATE_ABOUT_TO_TX)),
+
+        Transition(STATE_RX_STARTED, SYMBOL_TEXT, __onFrameData,
+                   targets=(STATE_RX_STARTED, STATE_RX_FINISHED, STATE_TX_STARTED, STATE_IDLE)),
+        Transition(STATE_RX_STARTED, SYMBOL_TIMEOUT, __onMessageMissing, STATE_IDLE, (STATE_IDLE, STATE_ABOUT_TO_TX)),
+    ], CODE_STATE, CODE_INPUT)
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2015-2016 Alexey Naumov <rocketbuzzz@gmail.com>
+#
+# This file is part of rbisync.
+#
+# rbisync is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import random
+
+RTT_ALPHA = 0.125  # gain of the smoothed round trip time
+RTT_BETA = 0.25  # gain of the round trip time variation
+RTT_K = 4  # timeout = smoothed round trip time + RTT_K * variation
+RTT_GRANULARITY = 10  # (ms) the least margin over the smoothed round trip time, timers fire that late (see WHEEL_PERIOD)
+
+TIMEOUT_MINIMUM = 20  # (ms)
+TIMEOUT_MAXIMUM = 5000  # (ms)
+BACKOFF_MAXIMUM = 10000  # (ms)
+
+BITS_PER_CHARACTER = 11  # start, 8 data, parity and stop bits; an upper bound for every line setting
+RECEIVE_FIFO = 16  # characters a UART may collect before handing them over, so the start of a frame comes that late
+
+
+class RttEstimator(object):
+    '''
+    Smoothed round trip time and its variation (Jacobson/Karels).
+    Until the first sample the timeout is the initial one.
+    '''
+
+    def __init__(self, initial):
+        self.initial = initial
+        self.srtt = None
+        self.rttvar = None
+        self.samples = 0
+
+    def sample(self, rtt):
+        rtt = max(rtt, 0)
+        if self.srtt is None:
+            self.srtt = float(rtt)
+            self.rttvar = rtt / 2.0
+        else:
+            self.rttvar = (1 - RTT_BETA) * self.rttvar + RTT_BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - RTT_ALPHA) * self.srtt + RTT_ALPHA * rtt
+
+        self.samples += 1
+
+    def timeout(self):
+        if self.srtt is None:
+            return self.initial
+
+        return min(max(self.srtt + max(RTT_K * self.rttvar, RTT_GRANULARITY), TIMEOUT_MINIMUM), TIMEOUT_MAXIMUM)
+
+
+class LinkTimeouts(object):
+    '''
+    Protocol timeouts of one port: the peer's measured turnaround plus the time the characters spend on the line.
+    The round trips are measured without the transmission time, so the estimates do not depend on frame length.
+    '''
+
+    def __init__(self, baudRate, enqWaitForAck, messageWaitForAck, ackWaitForMessage, ackWaitForEot):
+        self.__baudRate = baudRate  # callable, the current baud rate of the port or None
+        self.bid = RttEstimator(enqWaitForAck)  # ENQ -> ACK
+        self.message = RttEstimator(messageWaitForAck)  # message -> ACK
+        self.__ackWaitForMessage = ackWaitForMessage
+        self.__ackWaitForEot = ackWaitForEot
+        self.random = random  # the source of the backoff jitter, a seeded random.Random() makes runs repeatable
+
+    def transmissionTime(self, length):
+        '''
+        (ms) for length characters to cross the line.
+        '''
+        baudRate = self.__baudRate()
+        if not baudRate:
+            return 0
+
+        return length * BITS_PER_CHARACTER * 1000.0 / baudRate
+
+    def enqWaitForAck(self):
+        return self.bid.timeout() + self.transmissionTime(2)
+
+    def messageWaitForAck(self, length):
+        return self.message.timeout() + self.transmissionTime(length + 1 + RECEIVE_FIFO)  # or the start of a reply
+
+    def ackWaitForMessage(self):
+        # the peer turns the line around like it does for our ENQ, the timer is restarted as the frame comes in
+        turnaround = self.bid.timeout() if self.bid.samples else self.__ackWaitForMessage
+        return turnaround + self.transmissionTime(2 + RECEIVE_FIFO)
+
+    def ackWaitForEot(self):
+        turnaround = self.bid.timeout() if self.bid.samples else self.__ackWaitForEot
+        return turnaround + self.transmissionTime(2)
+
+    def backoff(self, retry):
+        '''
+        (ms) to wait for ACK after the retry-th repeated ENQ: exponential with a random jitter of +-50%.
+        '''
+        delay = min(self.enqWaitForAck() * (2 ** retry), BACKOFF_MAXIMUM)
+        return delay * self.random.uniform(0.5, 1.5)
+
+    def contentionBackoff(self):
+        '''
+        (ms) to wait before bidding again after a collision, random so that the stations drift apart.
+        '''
+        return self.enqWaitForAck() * self.random.uniform(0.5, 2.0)
+
+    def sampleBid(self, rtt):
+        self.bid.sample(rtt - self.transmissionTime(2))
+
+    def sampleMessage(self, rtt, length):
+        self.message.sample(rtt - self.transmissionTime(length + 1))
+
+    def estimates(self):
+        return {"bidRtt": self.bid.srtt,
+                "bidRttVariation": self.bid.rttvar,
+                "messageRtt": self.message.srtt,
+                "messageRttVariation": self.message.rttvar,
+                "enqWaitForAck": self.enqWaitForAck(),
+                "ackWaitForMessage": self.ackWaitForMessage(),
+                "ackWaitForEot": self.ackWaitForEot()}
@@ -0,0 +1,424 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2015-2016 Alexey Naumov <rocketbuzzz@gmail.com>
+#
+# This file is part of rbisync.
+#
+# rbisync is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import time
+import math
+import sched
+import select
+import threading
+import heapq
+import itertools
+from abc import abstractmethod
+
+
+class AbstractScheduler(object):
+    '''
+    Source of time and one-shot timers for the protocol handles.
+    All intervals are in milliseconds.
+    '''
+
+    @abstractmethod
+    def callLater(self, interval, callback):
+        '''
+        Calls callback once after interval milliseconds.
+        Returns an object with the cancel() method.
+        '''
+        pass
+
+    def now(self):
+        return time.time() * 1000
+
+    def callSoonThreadsafe(self, callback):
+        '''
+        Calls callback in the scheduler's thread as soon as possible, may be called from any thread.
+        '''
+        raise NotImplementedError("%s can not be woken up from another thread." % type(self).__name__)
+
+
+QT_WAKER = None  # the QObject class behind QtScheduler.callSoonThreadsafe(), see qtWakerClass()
+
+
+def qtWakerClass():
+    # defined on first use, PyQt4 is only imported when a QtScheduler is created
+    global QT_WAKER
+    if QT_WAKER is None:
+        from PyQt4.QtCore import QObject, pyqtSignal, pyqtSlot
+
+        class QtWaker(QObject):
+            wake = pyqtSignal(object)
+
+            @pyqtSlot(object)
+            def call(self, callback):
+                callback()
+
+        QT_WAKER = QtWaker
+
+    return QT_WAKER
+
+
+class QtTimer(object):
+    def __init__(self, timer, callback):
+        self.__timer = timer
+        self.__callback = callback
+        self.__active = True
+
+        self.__timer.timeout.connect(self.__onTimeout)
+
+    def __onTimeout(self):
+        if self.__active:
+            self.__active = False
+            self.__timer.deleteLater()  # never delete a QTimer from its own timeout()
+            self.__callback()
+
+    def cancel(self):
+        if self.__active:
+            self.__active = False
+            self.__timer.stop()
+            self.__timer.deleteLater()
+
+
+class QtScheduler(AbstractScheduler):
+    '''
+    Runs the timers in the Qt event loop. PyQt4 is only imported when this scheduler is created.
+    '''
+
+    def __init__(self):
+        from PyQt4.QtCore import Qt, QObject, QTimer
+
+        self.__owner = QObject()  # the timers belong to it, so dropping a QtTimer does not destroy a running QTimer
+        self.__timer_class = QTimer
+
+        # emitted from any thread, delivered by the event loop of the thread the scheduler was created in
+        self.__waker = qtWakerClass()()
+        self.__waker.wake.connect(self.__waker.call, Qt.QueuedConnection)
+
+    def callLater(self, interval, callback):
+        timer = self.__timer_class(self.__owner)
+        timer.setSingleShot(True)
+        qtTimer = QtTimer(timer, callback)
+        timer.start(interval)
+
+        return qtTimer
+
+    def callSoonThreadsafe(self, callback):
+        self.__waker.wake.emit(callback)
+
+
+class LoopScheduler(AbstractScheduler):
+    '''
+    Runs the timers in an asyncio (or trollius) event loop.
+    '''
+
+    def __init__(self, loop):
+        self.__loop = loop
+
+    def callLater(self, interval, callback):
+        return self.__loop.call_later(interval / 1000.0, callback)
+
+    def now(self):
+        return self.__loop.time() * 1000
+
+    def callSoonThreadsafe(self, callback):
+        self.__loop.call_soon_threadsafe(callback)
+
+    @property
+    def loop(self):
+        return self.__loop
+
+
+class SchedTimer(object):
+    def __init__(self, scheduler, event):
+        self.__scheduler = scheduler
+        self.__event = event
+
+    def cancel(self):
+        try:
+            self.__scheduler.cancel(self.__event)
+        except ValueError:
+            pass  # fired already
+
+
+class SchedScheduler(AbstractScheduler):
+    '''
+    Runs the timers in a standard library sched.scheduler, nothing happens until run() is called.
+    No event loop is needed, so it suits simulations and scripts (see loopback.py).
+    It waits on a pipe rather than sleeps, so callSoonThreadsafe() wakes it up at once.
+    '''
+
+    def __init__(self):
+        self.__scheduler = sched.scheduler(time.time, self.__sleep)
+        self.__sequence = itertools.count()  # timers due at the same time fire in the order they were armed
+        self.__wakeup = os.pipe()
+        self.__woken = False  # a byte is in the pipe or about to be, the next ones need none
+        self.__lock = threading.Lock()
+
+    def callLater(self, interval, callback):
+        event = self.__scheduler.enter(interval / 1000.0, next(self.__sequence), callback, ())
+        return SchedTimer(self.__scheduler, event)
+
+    def callSoonThreadsafe(self, callback):
+        self.__scheduler.enter(0, next(self.__sequence), callback, ())  # sched.run() copes with pushes from threads
+        with self.__lock:
+            if self.__woken:
+                return
+            self.__woken = True
+
+        os.write(self.__wakeup[1], "w")
+
+    def __sleep(self, interval):
+        if interval <= 0:
+            return
+
+        readable, _, _ = select.select([self.__wakeup[0]], [], [], interval)
+        if readable:
+            os.read(self.__wakeup[0], 512)
+            with self.__lock:
+                self.__woken = False
+
+    def run(self):
+        '''
+        Fires the timers in real time until there is none left.
+        '''
+        self.__scheduler.run()
+
+    def close(self):
+        for fd in self.__wakeup:
+            os.close(fd)
+
+
+class VirtualTimer(object):
+    __slots__ = ("scheduler", "expires", "callback", "active")
+
+    def __init__(self, scheduler, expires, callback):
+        self.scheduler = scheduler
+        self.expires = expires
+        self.callback = callback
+        self.active = True
+
+    def cancel(self):
+        if self.active:
+            self.active = False
+            self.scheduler.discard(self)
+
+
+class VirtualScheduler(AbstractScheduler):
+    '''
+    Simulated clock: time only moves when advance() or run() is called, and then it jumps straight
+    to the next timer, so the timeouts and retries of the protocol take no wall time at all.
+    Timers due at the same time fire in the order they were armed, runs are fully deterministic.
+    callSoonThreadsafe() may be called from any thread while run() goes on in another one.
+    '''
+
+    def __init__(self, start=0):
+        self.__now = start
+        self.__timers = []  # heap of (expires, sequence, timer), cancelled timers are skipped when popped
+        self.__sequence = itertools.count()
+        self.__count = 0  # timers armed and not fired or cancelled yet
+        self.__lock = threading.Lock()  # guards the heap and the count against callSoonThreadsafe()
+        self.firedCount = 0
+
+    def callLater(self, interval, callback):
+        with self.__lock:
+            timer = VirtualTimer(self, self.__now + max(interval, 0), callback)
+            heapq.heappush(self.__timers, (timer.expires, next(self.__sequence), timer))
+            self.__count += 1
+
+        return timer
+
+    def callSoonThreadsafe(self, callback):
+        self.callLater(0, callback)  # at the current virtual time, after the timers already due then
+
+    def discard(self, timer):
+        with self.__lock:
+            self.__count -= 1
+
+    def now(self):
+        return self.__now
+
+    def advance(self, interval):
+        '''
+        Moves the clock interval ms forward firing the timers due on the way, returns the number fired.
+        '''
+        return self.__run(self.__now + interval)
+
+    def run(self, limit=None):
+        '''
+        Fires the timers until there is none left or the clock reaches limit (ms), returns the number fired.
+        '''
+        return self.__run(limit)
+
+    def __run(self, deadline):
+        fired = 0
+        timers = self.__timers
+        while True:
+            with self.__lock:  # released while the callback runs, it may arm timers of its own
+                if not timers or (deadline is not None and timers[0][0] > deadline):
+                    break
+
+                expires, _, timer = heapq.heappop(timers)
+                if not timer.active:
+                    continue
+
+                timer.active = False
+                self.__count -= 1
+                self.__now = max(self.__now, expires)
+
+            fired += 1
+            timer.callback()
+
+        if deadline is not None:
+            with self.__lock:
+                self.__now = max(self.__now, deadline)
+
+        self.firedCount += fired
+        return fired
+
+    @property
+    def pending(self):
+        return self.__count
+
+
+WHEEL_BITS = 8
+WHEEL_SIZE = 1 << WHEEL_BITS  # slots per level
+WHEEL_MASK = WHEEL_SIZE - 1
+WHEEL_LEVELS = 3  # 1 ms resolution, the top level reaches 2^24 ms (4.6 hours)
+WHEEL_PERIOD = 10  # (ms) how often the wheel wakes up while it has pending timers
+
+
+class WheelTimer(object):
+    __slots__ = ("wheel", "expires", "callback", "slot")
+
+    def __init__(self, wheel, expires, callback):
+        self.wheel = wheel
+        self.expires = expires
+        self.callback = callback
+        self.slot = None
+
+    def cancel(self):
+        if self.slot is not None:
+            self.wheel.discard(self)
+
+
+class TimerWheel(AbstractScheduler):
+    '''
+    Hierarchical timing wheel with millisecond resolution.
+    Meant to be shared by the handles of all ports in a process: arming and cancelling a timer is O(1),
+    the wheel itself holds a single timer of the base scheduler and fires the expired timers in batches.
+    '''
+
+    def __init__(self, base, period=WHEEL_PERIOD):
+        self.__base = base
+        self.__period = period
+        self.__levels = [[set() for _ in xrange(WHEEL_SIZE)] for _ in xrange(WHEEL_LEVELS)]
+        self.__current = self.__tick()  # the last tick processed
+        self.__count = 0  # timers armed and not fired or cancelled yet
+        self.__ticking = False
+
+    def __tick(self):
+        return int(self.__base.now())
+
+    def __place(self, timer):
+        delta = timer.expires - self.__current
+        for level in xrange(WHEEL_LEVELS):
+            if delta < (WHEEL_SIZE << (WHEEL_BITS * level)) or level == WHEEL_LEVELS - 1:
+                break
+
+        expires = timer.expires
+        if delta >= (WHEEL_SIZE << (WHEEL_BITS * level)):
+            expires = self.__current + (WHEEL_SIZE << (WHEEL_BITS * level)) - 1  # too far, re-placed on the way
+
+        slot = self.__levels[level][(expires >> (WHEEL_BITS * level)) & WHEEL_MASK]
+        slot.add(timer)
+        timer.slot = slot
+
+    def __cascade(self, level):
+        index = (self.__current >> (WHEEL_BITS * level)) & WHEEL_MASK
+        slot = self.__levels[level][index]
+        if not slot:
+            return index
+
+        self.__levels[level][index] = set()
+        for timer in slot:
+            self.__place(timer)
+
+        return index
+
+    def __advance(self, tick):
+        fired = []
+        while self.__current < tick:
+            self.__current += 1
+
+            index = self.__current & WHEEL_MASK
+            level = 1
+            while index == 0 and level < WHEEL_LEVELS:
+                index = self.__cascade(level)
+                level += 1
+
+            slot = self.__levels[0][self.__current & WHEEL_MASK]
+            if slot:
+                self.__levels[0][self.__current & WHEEL_MASK] = set()
+                fired.extend(slot)
+
+        for timer in fired:
+            if timer.slot is None:
+                continue  # cancelled by one of the callbacks fired before it
+
+            timer.slot = None
+            self.__count -= 1
+            timer.callback()
+
+    def __onTick(self):
+        self.__advance(self.__tick())  # the timers armed by the callbacks are placed relative to the current tick
+        self.__ticking = False
+
+        if self.__count:
+            self.__start()
+
+    def __start(self):
+        if not self.__ticking:
+            self.__ticking = True
+            self.__base.callLater(self.__period, self.__onTick)
+
+    def callLater(self, interval, callback):
+        if not self.__ticking:
+            self.__current = self.__tick()  # nothing was pending, there is nothing to catch up with
+
+        # due interval after the real time, not after the last tick processed: that may be a period behind
+        timer = WheelTimer(self, int(math.ceil(self.__base.now() + max(interval, 1))), callback)
+        self.__place(timer)
+        self.__count += 1
+        self.__start()
+
+        return timer
+
+    def discard(self, timer):
+        timer.slot.discard(timer)
+        timer.slot = None
+        self.__count -= 1
+
+    def now(self):
+        return self.__base.now()
+
+    def callSoonThreadsafe(self, callback):
+        self.__base.callSoonThreadsafe(callback)
+
+    @property
+    def pending(self):
+        return self.__count
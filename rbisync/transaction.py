@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2015-2016 Alexey Naumov <rocketbuzzz@gmail.com>
+#
+# This file is part of rbisync.
+#
+# rbisync is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from collections import deque
+from outbound import Delivery
+
+
+class Transaction(Delivery):
+    '''
+    A request and the reply frame it waits for, returned by Bisync.transact().
+    Resolves with the reply (see Transaction.reply), fails if the request is not delivered or no reply comes in time.
+    '''
+
+    def __init__(self, request, enqueued, key=None, match=None):
+        Delivery.__init__(self, request, enqueued)
+        self.key = key
+        self.match = match  # predicate, None matches any frame
+        self.delivery = None  # of the request
+        self.reply = None
+        self.timer = None
+
+    def matches(self, frame):
+        return self.match is None or self.match(frame)
+
+
+class TransactionIndex(object):
+    '''
+    Transactions waiting for a reply.
+    Keyed transactions are found by the correlation key of the frame in O(1), the others are tried in order.
+    A keyed transaction with a match predicate too only takes the frames with its key that satisfy it.
+    '''
+
+    def __init__(self):
+        self.__keyed = {}  # key=correlation key, value=deque of the transactions waiting for it
+        self.__scanned = []
+        self.__count = 0
+
+    def __len__(self):
+        return self.__count
+
+    def add(self, transaction):
+        if transaction.key is None:
+            self.__scanned.append(transaction)
+        else:
+            self.__keyed.setdefault(transaction.key, deque()).append(transaction)
+        self.__count += 1
+
+    def remove(self, transaction):
+        if transaction.key is None:
+            if transaction in self.__scanned:
+                self.__scanned.remove(transaction)
+                self.__count -= 1
+            return
+
+        waiting = self.__keyed.get(transaction.key)
+        if waiting and transaction in waiting:
+            self.__removeKeyed(transaction.key, waiting, transaction)
+
+    def __removeKeyed(self, key, waiting, transaction):
+        if waiting[0] is transaction:
+            waiting.popleft()
+        else:
+            waiting.remove(transaction)
+
+        if not waiting:
+            del self.__keyed[key]
+        self.__count -= 1
+
+    def match(self, frame, correlationKey=None):
+        '''
+        Removes and returns the transaction the frame replies to, None if there is none.
+        '''
+        if self.__keyed and correlationKey is not None:
+            key = correlationKey(frame)
+            waiting = self.__keyed.get(key)
+            if waiting:
+                for transaction in waiting:  # the oldest one, unless its predicate turns the frame down
+                    if transaction.matches(frame):
+                        self.__removeKeyed(key, waiting, transaction)
+                        return transaction
+
+        for index, transaction in enumerate(self.__scanned):
+            if transaction.matches(frame):
+                del self.__scanned[index]
+                self.__count -= 1
+                return transaction
+
+        return None
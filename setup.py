@@ -11,5 +11,5 @@ setup(name="rbisync",
               'icons/*',
           ],
       },      
-      scripts=["bdbg/bdbg"]
+      scripts=["bdbg/bdbg", "rbisync/rbisync-gateway"]
 )
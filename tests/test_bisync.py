@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2015-2016 Alexey Naumov <rocketbuzzz@gmail.com>
+#
+# This file is part of rbisync.
+#
+# rbisync is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import sys
+import types
+import unittest
+
+
+class Serial(object):
+    '''
+    Stands in for rserial's Serial (and PyQt4 behind it): a read callback, an error callback and a state
+    of its own, like the real one.
+    '''
+
+    PARITY_NONE, PARITY_EVEN, PARITY_ODD, PARITY_MARK, PARITY_SPACE = range(5)
+    STOPBITS_ONE, STOPBITS_ONE_POINT_FIVE, STOPBITS_TWO = range(3)
+    DATABITS_FIVE, DATABITS_SIX, DATABITS_SEVEN, DATABITS_EIGHT = (5, 6, 7, 8)
+
+    def __init__(self, parent=None):
+        self.__on_read = None
+        self.__on_error = None
+        self.written = []
+        self.closed = False
+
+    def readyRead(self, data):
+        # what the port does when data comes in
+        if self.__on_read:
+            self.__on_read(data)
+
+    def write(self, data):
+        self.written.append(data)
+
+    def close(self):
+        self.closed = True
+
+    def errorString(self):
+        return "serial port error"
+
+    @property
+    def onRead(self):
+        return self.__on_read
+
+    @onRead.setter
+    def onRead(self, callback):
+        self.__on_read = callback
+
+    @property
+    def onError(self):
+        return self.__on_error
+
+    @onError.setter
+    def onError(self, callback):
+        self.__on_error = callback
+
+    @property
+    def state(self):
+        return "serial state"
+
+
+if "rserial.serial" not in sys.modules:
+    sys.modules["rserial"] = types.ModuleType("rserial")
+    sys.modules["rserial.serial"] = module = types.ModuleType("rserial.serial")
+    module.Serial = Serial
+
+from rbisync.bisync import Bisync
+from rbisync.protocol import ENQ, ACK, STX, ETX, EOT, STATE_IDLE, STATE_ABOUT_TO_TX, CODE_DESCRIPTION
+from rbisync.scheduler import VirtualScheduler
+
+
+class BisyncTest(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = VirtualScheduler()
+        self.port = Bisync(scheduler=self.scheduler)
+
+    def testOnReadIsTheProtocols(self):
+        # as bdbg's Dialog does: the callback gets messages, not the raw bytes
+        received = []
+        self.port.onRead = received.append
+        blockCheck = self.port.blockCheck
+        frame = STX + "hello" + ETX + blockCheck.encode(blockCheck.update(blockCheck.compute("hello"), ETX))
+        for data in (ENQ, frame, EOT):
+            self.port.readyRead(data)
+
+        self.assertEqual(received, ["hello"])
+        self.assertEqual(self.port.written, [ACK, ACK])  # the bid and the message acknowledged
+
+    def testOnError(self):
+        errors = []
+        self.port.onError = errors.append
+        self.port.write("hello")
+        self.scheduler.run()
+
+        self.assertEqual(errors[-1][0], 2)  # nobody answers
+
+    def testStateAndErrorString(self):
+        self.assertEqual(self.port.state, STATE_IDLE)
+        self.port.write("hello")
+        self.assertEqual(self.port.state, STATE_ABOUT_TO_TX)
+        self.assertEqual(self.port.written, [ENQ])
+        self.assertEqual(self.port.errorString(3), CODE_DESCRIPTION[3])
+
+    def testClose(self):
+        delivery, = self.port.write("hello")
+        self.port.close()
+
+        self.assertTrue(self.port.closed)
+        self.assertEqual(self.port.state, STATE_IDLE)
+        self.assertEqual(delivery.error[0], 12)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2015-2016 Alexey Naumov <rocketbuzzz@gmail.com>
+#
+# This file is part of rbisync.
+#
+# rbisync is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import tempfile
+import unittest
+from rbisync.loopback import LoopbackLink, LoopbackPort, SimulatedPeer, PROFILES
+from rbisync.capture import Replayer, RECORD, HEADER, RECORD_TX, RECORD_RX, RECORD_STATE
+from rbisync.scheduler import VirtualScheduler
+
+MESSAGES = 40
+RING_SIZE = 2048  # (bytes) of the small ring, a few exchanges fill it
+
+
+def captureRun(path, size):
+    '''
+    The same exchange every time: MESSAGES messages of growing length sent one after another, all the traffic
+    of the sending station captured in a ring of size bytes. Returns the records read back.
+    '''
+    scheduler = VirtualScheduler()
+    link = LoopbackLink(scheduler, PROFILES["lan"], seed=0)
+    station = LoopbackPort(link)
+    SimulatedPeer(link)
+    station.startCapture(path, size)
+
+    station.write(["message%03d-%s" % (index, "x" * index) for index in xrange(MESSAGES)])
+    scheduler.run()
+    station.stopCapture()
+
+    return list(Replayer(path).records())
+
+
+class CaptureTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def testEverythingRecorded(self):
+        records = captureRun(self.path("full.cap"), 1 << 20)
+        kinds = set(kind for _, kind, _ in records)
+        self.assertEqual(kinds, set([RECORD_TX, RECORD_RX, RECORD_STATE]))
+
+        transmitted = "".join(data for _, kind, data in records if kind == RECORD_TX)
+        for index in xrange(MESSAGES):
+            self.assertTrue("message%03d-%s" % (index, "x" * index) in transmitted)
+
+        timestamps = [timestamp for timestamp, _, _ in records]
+        self.assertEqual(timestamps, sorted(timestamps))
+
+    def testWrapAround(self):
+        full = captureRun(self.path("full.cap"), 1 << 20)
+        ring = captureRun(self.path("ring.cap"), RING_SIZE)
+
+        # the traffic took more than the ring, the oldest records were overwritten
+        self.assertTrue(sum(RECORD.size + len(data) for _, _, data in full) > RING_SIZE - HEADER.size)
+        self.assertTrue(0 < len(ring) < len(full))
+        self.assertTrue(sum(RECORD.size + len(data) for _, _, data in ring) <= RING_SIZE - HEADER.size)
+        self.assertEqual(ring, full[-len(ring):])  # what is left is the latest, in order
+
+    def testContinued(self):
+        # a second capture into the same file carries on after the records of the first
+        first = captureRun(self.path("full.cap"), 1 << 20)
+        both = captureRun(self.path("full.cap"), 1 << 20)
+        self.assertEqual(both, first + first)  # the runs are the same to the timestamp
+
+
+if __name__ == "__main__":
+    unittest.main()
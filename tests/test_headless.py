@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2015-2016 Alexey Naumov <rocketbuzzz@gmail.com>
+#
+# This file is part of rbisync.
+#
+# rbisync is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import unittest
+from rbisync.headless import LoopBisync
+from rbisync.protocol import ENQ, STATE_ABOUT_TO_TX, STATE_IDLE
+from rbisync.outbound import DELIVERY_PENDING
+from rbisync.scheduler import VirtualScheduler
+
+
+class StubLoop(object):
+    '''
+    Just enough of an asyncio loop for LoopBisync: the callbacks registered are kept, never called.
+    '''
+
+    def __init__(self):
+        self.readers = {}
+        self.writers = {}
+
+    def add_reader(self, fd, callback):
+        self.readers[fd] = callback
+
+    def remove_reader(self, fd):
+        del self.readers[fd]
+
+    def add_writer(self, fd, callback):
+        self.writers[fd] = callback
+
+    def remove_writer(self, fd):
+        del self.writers[fd]
+
+
+class LoopBisyncTest(unittest.TestCase):
+    def setUp(self):
+        self.master, slave = os.openpty()
+        self.path = os.ttyname(slave)
+        os.close(slave)
+
+        self.scheduler = VirtualScheduler()
+        self.port = LoopBisync(StubLoop(), self.scheduler)
+        self.port.port = self.path
+
+    def tearDown(self):
+        self.port.close()
+        os.close(self.master)
+
+    def testWriteBeforeOpen(self):
+        # the gateway keeps trying to open its port, clients may write meanwhile
+        deliveries = self.port.write("one two")
+        self.assertEqual(self.port.state, STATE_IDLE)
+        self.assertEqual(self.scheduler.pending, 0)  # no timer of a bid that never went out
+        self.assertEqual(len(self.port.messages), 2)
+
+        self.port.open()
+        self.assertEqual(self.port.state, STATE_ABOUT_TO_TX)
+        self.assertEqual(os.read(self.master, 16), ENQ)
+        self.assertEqual(self.scheduler.pending, 1)  # waiting for the ACK
+        self.assertEqual([delivery.status for delivery in deliveries], [DELIVERY_PENDING] * 2)
+
+    def testCloseFailsQueued(self):
+        self.port.open()
+        delivery, = self.port.write("one")
+        self.assertEqual(os.read(self.master, 16), ENQ)
+
+        self.port.close()
+        self.assertEqual(delivery.error[0], 12)
+        self.assertEqual(self.scheduler.pending, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
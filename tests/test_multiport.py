@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2015-2016 Alexey Naumov <rocketbuzzz@gmail.com>
+#
+# This file is part of rbisync.
+#
+# rbisync is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+from rbisync.loopback import LoopbackLink, LoopbackPort, SimulatedPeer, PROFILES
+from rbisync.outbound import DELIVERY_DELIVERED
+from rbisync.scheduler import VirtualScheduler, TimerWheel
+
+LINES = 32
+MESSAGES = 20  # per line
+
+
+class Line(object):
+    '''
+    A station sending MESSAGES messages of its own to a peer over a link of its own, one at a time.
+    '''
+
+    def __init__(self, scheduler, wheel, number, profile="lan"):
+        self.number = number
+        self.link = LoopbackLink(scheduler, PROFILES[profile], seed=number)
+        self.station = LoopbackPort(self.link, scheduler=wheel)
+        self.peer = SimulatedPeer(self.link, scheduler=wheel)
+        self.received = []
+        self.peer.onRead = self.received.append
+        self.errors = []
+        self.station.onError = self.errors.append
+        self.sent = ["line%02d-message%03d" % (number, index) for index in xrange(MESSAGES)]
+        self.deliveries = []
+        self.finished = None
+
+    def start(self):
+        self.__sendNext()
+
+    def __sendNext(self, delivery=None):
+        if len(self.deliveries) == len(self.sent):
+            self.finished = self.link.scheduler.now()
+            return
+
+        delivery = self.station.write(self.sent[len(self.deliveries)])[0]
+        self.deliveries.append(delivery)
+        delivery.addCallback(self.__sendNext)
+
+
+def runLines(numbers, profile="lan"):
+    # the ports share one timer wheel, as they do in production (see bisync and headless defaultScheduler())
+    scheduler = VirtualScheduler()
+    wheel = TimerWheel(scheduler)
+    lines = [Line(scheduler, wheel, number, profile) for number in numbers]
+    for line in lines:
+        line.start()
+
+    scheduler.run()
+    return lines
+
+
+class MultiPortTest(unittest.TestCase):
+    def setUp(self):
+        self.lines = runLines(range(LINES))
+
+    def testNoCrossTraffic(self):
+        for line in self.lines:
+            self.assertEqual(line.received, line.sent)
+            self.assertEqual(line.station.messages.stats()["dequeued"], MESSAGES)
+
+    def testAllDelivered(self):
+        for line in self.lines:
+            self.assertEqual([delivery.status for delivery in line.deliveries], [DELIVERY_DELIVERED] * MESSAGES)
+            self.assertEqual(line.errors, [])
+
+    def testThroughputUnchanged(self):
+        # every line takes exactly as long as it does alone in the process
+        for line in self.lines:
+            alone, = runLines([line.number])
+            self.assertTrue(line.finished > 0)
+            self.assertEqual(line.finished, alone.finished)
+            self.assertEqual([delivery.latency for delivery in line.deliveries],
+                             [delivery.latency for delivery in alone.deliveries])
+
+
+    def testTimeoutsUnchanged(self):
+        # on a noisy line the timeouts fire, through the wheel all the lines share
+        lines = runLines(range(8), "noisy")
+        for line in lines:
+            alone, = runLines([line.number], "noisy")
+            self.assertEqual([delivery.status for delivery in line.deliveries],
+                             [delivery.status for delivery in alone.deliveries])
+            self.assertEqual(line.errors, alone.errors)
+            self.assertEqual(line.finished, alone.finished)
+
+        self.assertTrue(any(line.errors for line in lines))  # or nothing timed out
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2015-2016 Alexey Naumov <rocketbuzzz@gmail.com>
+#
+# This file is part of rbisync.
+#
+# rbisync is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+from rbisync.loopback import LoopbackLink, LoopbackPort, SimulatedPeer, LinkProfile, PROFILES, runContentionBenchmark
+from rbisync.protocol import ACK, STX, ETX, ETB, DLE, STATE_RX_FINISHED, STATE_IDLE
+from rbisync.protocol import ROLE_NONE, ROLE_PRIMARY, ROLE_SECONDARY, PRIORITY_BULK, PRIORITY_URGENT
+from rbisync.outbound import DELIVERY_DELIVERED, DELIVERY_FAILED, OVERFLOW_DROP_OLDEST, QueueOverflowError
+from rbisync.scheduler import VirtualScheduler
+
+BINARY = "".join(chr(code) for code in xrange(256)) * 2  # every control character, DLE included, twice
+
+
+class RecordingPort(LoopbackPort):
+    '''
+    A station keeping a copy of every chunk it transmits.
+    '''
+
+    def __init__(self, link, blockCheck=None):
+        LoopbackPort.__init__(self, link, blockCheck)
+        self.transmitted = []
+
+    def _transmit(self, data):
+        self.transmitted.append(memoryview(data).tobytes())
+        LoopbackPort._transmit(self, data)
+
+
+class SilentPeer(LoopbackPort):
+    '''
+    A station that is switched off: it never answers.
+    '''
+
+    def _receive(self, data):
+        pass
+
+
+class MutePeer(SimulatedPeer):
+    '''
+    A peer that answers the bids but never acknowledges a message.
+    '''
+
+    def writeACK(self, ack=ACK):
+        if self.state == STATE_RX_FINISHED:
+            self._enter(STATE_IDLE)
+            return
+
+        SimulatedPeer.writeACK(self, ack)
+
+
+class ProtocolTest(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = VirtualScheduler()
+
+    def connect(self, profile=PROFILES["lan"], peerClass=SimulatedPeer):
+        self.link = LoopbackLink(self.scheduler, profile, seed=0)
+        self.station = RecordingPort(self.link)
+        self.peer = peerClass(self.link)
+        self.received = []
+        self.peer.onRead = self.received.append
+        self.errors = []
+        self.station.onError = self.errors.append
+
+    def assertFailed(self, delivery, code):
+        self.assertEqual(delivery.status, DELIVERY_FAILED)
+        self.assertEqual(delivery.error[0], code)
+
+    def testMultiBlock(self):
+        self.connect()
+        self.station.blockSize = 50
+        message = "".join(chr(ord("A") + index % 26) for index in xrange(480))
+        delivery, = self.station.write(message)
+        self.scheduler.run()
+
+        self.assertEqual(delivery.status, DELIVERY_DELIVERED)
+        self.assertEqual(self.received, [message])  # joined by the peer
+
+        frames = [chunk for chunk in self.station.transmitted if chunk.startswith(STX)]
+        self.assertEqual(len(frames), 10)
+        self.assertEqual([frame[-2] for frame in frames], [ETB] * 9 + [ETX])  # LRC is a single character
+
+    def testTransparent(self):
+        self.connect()
+        self.station.transparent = True
+        self.peer.transparent = True
+        delivery, = self.station.write(BINARY)
+        self.scheduler.run()
+
+        self.assertEqual(delivery.status, DELIVERY_DELIVERED)
+        self.assertEqual(self.received, [BINARY])
+        frame, = [chunk for chunk in self.station.transmitted if chunk.startswith(DLE + STX)]
+        self.assertEqual(frame.count(DLE + DLE), BINARY.count(DLE))
+
+    def testTransparentMultiBlock(self):
+        self.connect(PROFILES["modem"])
+        self.station.transparent = True
+        self.peer.transparent = True
+        self.station.blockSize = 100
+        self.station.write(BINARY)
+        self.scheduler.run()
+
+        self.assertEqual(self.received, [BINARY])
+        self.assertEqual(self.errors, [])
+
+    def testConversational(self):
+        self.connect()
+        self.station.conversational = True
+        self.peer.conversational = True
+        self.peer.onRead = lambda message: "re:" + message
+        replies = []
+        self.station.onRead = replies.append
+        deliveries = self.station.write("one two three")
+        self.scheduler.run()
+
+        self.assertEqual([delivery.status for delivery in deliveries], [DELIVERY_DELIVERED] * 3)
+        self.assertEqual(replies, ["re:one", "re:two", "re:three"])
+        self.assertEqual(self.errors, [])
+
+    def testTransaction(self):
+        self.connect()
+        self.peer.onRead = lambda message: self.peer.write("reply:" + message)
+        transaction = self.station.transact("request", match=lambda frame: frame.startswith("reply:"))
+        replies = []
+        transaction.addCallback(lambda done: replies.append(done.reply))
+        self.scheduler.run()
+
+        self.assertEqual(replies, ["reply:request"])
+
+    def testBytesRoutedPerPort(self):
+        self.connect()
+        other = LoopbackLink(self.scheduler, PROFILES["lan"], seed=1)
+        otherStation = LoopbackPort(other)
+        SimulatedPeer(other)
+        metrics = self.station.enableMetrics()
+
+        self.station._receive("noise")  # nobody waits for text in the idle state
+        self.station.write("hello")
+        otherStation.write("hello")
+        self.scheduler.run()
+
+        self.assertEqual(self.station.bytesDropped, len("noise"))
+        self.assertEqual(self.station.bytesRouted + self.station.bytesDropped, metrics.bytesReceived)
+        self.assertEqual(otherStation.bytesDropped, 0)
+        self.assertEqual(otherStation.bytesRouted, self.station.bytesRouted)
+
+    def testPeerNotResponding(self):
+        self.connect(peerClass=SilentPeer)
+        delivery, = self.station.write("hello")
+        self.scheduler.run()
+
+        self.assertFailed(delivery, 2)
+        self.assertEqual([code for code, _ in self.errors], [1, 1, 2])  # MAX_RETRY bids repeated first
+
+    def testMessageNotAcknowledged(self):
+        self.connect(peerClass=MutePeer)
+        delivery, = self.station.write("hello")
+        self.scheduler.run()
+
+        self.assertFailed(delivery, 3)
+        self.assertEqual(self.received, ["hello"])  # it got there, only the ACK is missing
+
+    def testMessageRefused(self):
+        self.connect(LinkProfile(baudRate=115200, latency=1, nakRate=1.0))
+        delivery, = self.station.write("hello")
+        self.scheduler.run()
+
+        self.assertFailed(delivery, 6)
+        self.assertEqual([code for code, _ in self.errors], [6])
+
+    def testLossyUnpacedLink(self):
+        # whole chunks get lost, a lone ENQ included
+        for seed in xrange(20):
+            self.scheduler = VirtualScheduler()
+            self.connect(LinkProfile(loss=0.3))
+            self.link.random.seed(seed)
+            deliveries = self.station.write("one two three")
+            self.scheduler.run()
+
+            self.assertTrue(all(delivery.done for delivery in deliveries))
+
+    def testQueueOverflow(self):
+        self.connect()
+        self.station.messages.highWaterMark = 2
+        self.station.messages.overflow = OVERFLOW_DROP_OLDEST
+        deliveries = self.station.write("m1 m2 m3")  # the bid for m1 is on its way, m1 is dropped all the same
+        self.scheduler.run()
+
+        self.assertFailed(deliveries[0], 9)
+        self.assertEqual([delivery.status for delivery in deliveries[1:]], [DELIVERY_DELIVERED] * 2)
+        self.assertEqual(self.received, ["m2", "m3"])
+
+    def testOverflowQueuesNothing(self):
+        self.connect()
+        self.station.messages.highWaterMark = 2
+        self.assertRaises(QueueOverflowError, self.station.write, "m1 m2 m3")
+        self.assertEqual(len(self.station.messages), 0)
+        self.assertEqual(self.station.transmitted, [])  # and bid for nothing
+
+        deliveries = self.station.write("m1 m2")
+        self.scheduler.run()
+        self.assertEqual([delivery.status for delivery in deliveries], [DELIVERY_DELIVERED] * 2)
+
+    def testResetFailsOutstanding(self):
+        self.connect(PROFILES["modem"])
+        deliveries = self.station.write("m1 m2 m3")
+        while not self.received:
+            self.scheduler.advance(1)
+        while self.station.messages.head().delivery is deliveries[1]:  # m2 is on the line
+            self.scheduler.advance(1)
+
+        self.station.reset()
+        self.assertEqual(deliveries[0].status, DELIVERY_DELIVERED)
+        for delivery in deliveries[1:]:
+            self.assertFailed(delivery, 12)
+        self.assertEqual(len(self.station.messages), 0)
+
+    def testSuperseded(self):
+        self.connect()
+        self.station.write("first")
+        old, = self.station.write("reg=1", PRIORITY_BULK, key="reg")
+        new, = self.station.write("reg=2", PRIORITY_URGENT, key="reg")
+        self.station.write("last")
+        self.scheduler.run()
+
+        self.assertFailed(old, 11)
+        self.assertEqual(new.status, DELIVERY_DELIVERED)
+        self.assertEqual(new.priority, PRIORITY_URGENT)
+        self.assertEqual(self.received, ["first", "reg=2", "last"])  # moved up, ahead of "last"
+
+
+class ContentionTest(unittest.TestCase):
+    def testWriteDuringBackoff(self):
+        # both stations collide, then get more to send while they back off: they must not bid in lockstep
+        scheduler = VirtualScheduler()
+        link = LoopbackLink(scheduler, PROFILES["lan"], seed=0)
+        stations = [RecordingPort(link), RecordingPort(link)]
+        deliveries = []
+        for station in stations:
+            station.enableMetrics()
+            deliveries.extend(station.write("first"))
+
+        while not all(station.metrics.collisions for station in stations):
+            scheduler.advance(0.1)
+
+        sent = [len(station.transmitted) for station in stations]
+        for station in stations:
+            deliveries.extend(station.write("second"))
+        self.assertEqual([len(station.transmitted) for station in stations], sent)  # no ENQ until the backoff is over
+
+        scheduler.run()
+        self.assertEqual([delivery.status for delivery in deliveries], [DELIVERY_DELIVERED] * 4)
+
+    def testRoles(self):
+        results = {}
+        for roles in ((ROLE_NONE, ROLE_NONE), (ROLE_PRIMARY, ROLE_SECONDARY), (ROLE_SECONDARY, ROLE_PRIMARY)):
+            results[roles] = runContentionBenchmark(PROFILES["lan"], roles, count=50, size=32)
+
+        for roles in ((ROLE_PRIMARY, ROLE_SECONDARY), (ROLE_SECONDARY, ROLE_PRIMARY)):
+            self.assertEqual(results[roles]["delivered"], results[roles]["messages"])
+            self.assertEqual(results[roles]["errors"], 0)
+            self.assertTrue(results[roles]["elapsed"] < results[ROLE_NONE, ROLE_NONE]["elapsed"])
+
+
+if __name__ == "__main__":
+    unittest.main()
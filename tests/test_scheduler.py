@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2015-2016 Alexey Naumov <rocketbuzzz@gmail.com>
+#
+# This file is part of rbisync.
+#
+# rbisync is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import random
+import threading
+import unittest
+from rbisync.scheduler import VirtualScheduler, TimerWheel, WHEEL_PERIOD, WHEEL_SIZE, WHEEL_BITS
+
+
+class TimerWheelTest(unittest.TestCase):
+    def setUp(self):
+        self.base = VirtualScheduler()
+        self.wheel = TimerWheel(self.base)
+        self.fired = []  # (due, fired at)
+
+    def arm(self, interval):
+        due = self.base.now() + interval
+        return self.wheel.callLater(interval, lambda: self.fired.append((due, self.base.now())))
+
+    def assertOnTime(self):
+        for due, firedAt in self.fired:
+            self.assertTrue(firedAt >= due, "fired %s ms early" % (due - firedAt))
+            # rounded up to the millisecond, then up to a period until the wheel ticks, to the millisecond again
+            self.assertTrue(firedAt <= due + WHEEL_PERIOD + 2, "fired %s ms late" % (firedAt - due))
+
+    def testNeverEarly(self):
+        rnd = random.Random(0)
+        for _ in xrange(2000):
+            self.base.advance(rnd.uniform(0, 3))  # at fractions of a millisecond, between the wheel's ticks
+            self.arm(rnd.choice((rnd.uniform(0, 1), rnd.uniform(1, 50), rnd.uniform(50, 2000))))
+
+        self.base.run()
+        self.assertEqual(len(self.fired), 2000)
+        self.assertEqual(self.wheel.pending, 0)
+        self.assertOnTime()
+
+    def testCascadeLevel1(self):
+        # over WHEEL_SIZE ms: placed on level 1 and cascaded down to level 0 on the way
+        for interval in (WHEEL_SIZE + 1, 300, 1000, 5000, (WHEEL_SIZE << WHEEL_BITS) - 1):
+            self.arm(interval)
+
+        self.base.run()
+        self.assertEqual(len(self.fired), 5)
+        self.assertOnTime()
+
+    def testCascadeLevel2(self):
+        # over 65.5 s: placed on level 2, cascaded to level 1, then to level 0
+        self.base.advance(123.4)
+        for interval in ((WHEEL_SIZE << WHEEL_BITS) + 1, 70000, 100000, 300000):
+            self.arm(interval)
+
+        self.base.run()
+        self.assertEqual(len(self.fired), 4)
+        self.assertOnTime()
+
+    def testCancelInBatch(self):
+        # due at the same tick, they fire as a batch: whichever comes first cancels the other
+        fired = []
+        timers = {}
+        timers["first"] = self.wheel.callLater(20, lambda: (fired.append("first"), timers["second"].cancel()))
+        timers["second"] = self.wheel.callLater(20, lambda: (fired.append("second"), timers["first"].cancel()))
+
+        self.base.run(1000)  # a wheel that lost count would tick forever
+        self.assertEqual(len(fired), 1)
+        self.assertEqual(self.wheel.pending, 0)
+
+    def testCancelLaterInBatch(self):
+        fired = []
+        victims = [self.wheel.callLater(20, lambda index=index: fired.append(index)) for index in xrange(10)]
+        self.wheel.callLater(20, lambda: [victim.cancel() for victim in victims])
+        self.base.advance(5)
+        victims[3].cancel()
+
+        self.base.run(1000)
+        self.assertTrue(3 not in fired)
+        self.assertEqual(self.wheel.pending, 0)
+        self.assertEqual(self.base.pending, 0)  # the wheel stopped ticking
+
+
+class VirtualSchedulerTest(unittest.TestCase):
+    def testCallSoonThreadsafe(self):
+        scheduler = VirtualScheduler()
+        called = []
+
+        def keepRunning():
+            if len(called) < 4000:
+                scheduler.callLater(1, keepRunning)
+
+        def produce():
+            for _ in xrange(1000):
+                scheduler.callSoonThreadsafe(lambda: called.append(1))
+
+        scheduler.callLater(0, keepRunning)
+        threads = [threading.Thread(target=produce) for _ in xrange(4)]
+        for thread in threads:
+            thread.start()
+        scheduler.run()
+        for thread in threads:
+            thread.join()
+        scheduler.run()
+
+        self.assertEqual(len(called), 4000)
+        self.assertEqual(scheduler.pending, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()